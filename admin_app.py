@@ -1,7 +1,7 @@
 import streamlit as st
 
 from admin_portal import admin_login_page, admin_dashboard
-from bookflow import BookFlowApp, show_books_page
+from bookflow import get_shared_app, show_books_page
 
 st.set_page_config(
     page_title="BookFlow Admin Portal",
@@ -12,13 +12,8 @@ st.set_page_config(
 
 
 def _ensure_app_instance():
-    if "app" not in st.session_state:
-        st.session_state.app = BookFlowApp()
-    elif not (
-        hasattr(st.session_state.app, "get_active_reservation")
-        and hasattr(st.session_state.app, "create_reservation")
-    ):
-        st.session_state.app = BookFlowApp()
+    st.session_state.app = get_shared_app()
+    st.session_state.app.refresh_if_changed()
 
 
 def _ensure_session_defaults():
@@ -32,14 +27,10 @@ def _ensure_session_defaults():
         st.session_state.page = "admin_login"
 
 
-_definitions_initialized = False
-
-
 def _prepare_state():
-    global _definitions_initialized
-    if not _definitions_initialized:
-        _ensure_app_instance()
-        _definitions_initialized = True
+    # The shared instance is cached per process, so attaching it on every
+    # rerun is cheap and also covers sessions opened after the first one.
+    _ensure_app_instance()
     _ensure_session_defaults()
 
 
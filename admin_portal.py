@@ -1,7 +1,11 @@
 import streamlit as st
-import json
+import csv
+import glob
+import io
 from datetime import datetime
-from security_utils import ensure_password_fields, hash_password
+from analytics import TransactionFrame
+from credential_service import CredentialServiceBusy
+from security_utils import hash_password
 from program_catalog import all_programmes
 
 __all__ = [
@@ -65,7 +69,11 @@ def admin_login_page():
         with col_a:
             if st.button("🔐 Admin Login", use_container_width=True, type="primary"):
                 if username and password:
-                    user = st.session_state.app.verify_login(username, password, "admin")
+                    try:
+                        user = st.session_state.app.verify_login(username, password, "admin")
+                    except CredentialServiceBusy as exc:
+                        st.warning(f"⏳ {exc} Please try again in a moment.")
+                        st.stop()
                     if user:
                         st.session_state.logged_in = True
                         st.session_state.user = user
@@ -101,20 +109,12 @@ def admin_dashboard():
         </div>
     """, unsafe_allow_html=True)
 
-    # Calculate statistics
-    total_books = sum(
-        len(books) 
-        for program_books in st.session_state.app.books.get('program_books', {}).values()
-        for books in [program_books]
-    )
-    
-    total_users = (
-        len(st.session_state.app.users.get('students', [])) + 
-        len(st.session_state.app.users.get('teachers', []))
-    )
-    
-    active_borrows = len([t for t in st.session_state.app.transactions if t.get('status') == 'borrowed'])
-    total_fines = sum(float(t.get('fine', 0)) for t in st.session_state.app.transactions)
+    # Running totals kept up to date by the app as books, users and loans change
+    stats = st.session_state.app.stats.snapshot()
+    total_books = stats['total_books']
+    total_users = stats['total_users']
+    active_borrows = stats['active_borrows']
+    total_fines = stats['total_fines']
 
     # Stats cards
     col1, col2, col3, col4 = st.columns(4)
@@ -152,27 +152,107 @@ def admin_dashboard():
         if st.button("🔄 Refresh Data", help="Reload all data from storage"):
             st.session_state.app.load_data()
             st.success("Data refreshed successfully!")
+
+        if st.button("🧮 Recount Statistics", help="Recalculate the dashboard totals from the loaded data"):
+            st.session_state.app.refresh_stats()
+            st.success("Dashboard statistics recalculated!")
             
         if st.button("💾 Backup Data", help="Create a backup of current data"):
             backup_file = f"bookflow_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(backup_file, 'w') as f:
-                json.dump({
-                    'users': st.session_state.app.users,
-                    'books': st.session_state.app.books,
-                    'transactions': st.session_state.app.transactions
-                }, f, indent=2)
+            st.session_state.app.storage.export_json(backup_file)
             st.success(f"Backup saved as {backup_file}")
 
+        backups = sorted(glob.glob("bookflow_backup_*.json"), reverse=True)
+        if backups:
+            restore_file = st.selectbox("Restore from backup", backups)
+            if st.button("♻️ Restore Backup", help="Replace all current data with the selected backup"):
+                st.session_state.app.restore_backup(restore_file)
+                st.success(f"Data restored from {restore_file}")
+
+        st.markdown("### 📬 Email Delivery")
+        outbox = st.session_state.app.outbox
+        st.caption(f"{outbox.pending_count()} message(s) waiting in the outbox")
+        batches = outbox.batch_stats()[-10:]
+        if batches:
+            st.dataframe([
+                {
+                    'Finished': datetime.fromtimestamp(batch['finished_at']).strftime('%Y-%m-%d %H:%M:%S'),
+                    'Sent': batch['sent'],
+                    'Failed': batch['failed'],
+                    'Seconds': round(batch['seconds'], 3),
+                    'Messages/s': round(batch['messages_per_second'], 1),
+                }
+                for batch in reversed(batches)
+            ], use_container_width=True)
+
+        st.markdown("### 🔐 Sign-in Checks")
+        metrics = st.session_state.app.credentials.metrics()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("✅ Verified", metrics['completed'], help=f"{metrics['in_flight']} in progress")
+        with col2:
+            st.metric("⛔ Rejected (busy)", metrics['rejected'], help=f"{metrics['failed']} timed out")
+        with col3:
+            st.metric("⏱️ Avg Hash", f"{metrics['avg_hash_ms']:.0f} ms")
+        with col4:
+            st.metric("⏳ Avg Queue", f"{metrics['avg_queue_ms']:.0f} ms", help=f"Longest wait {metrics['max_wait_ms']:.0f} ms")
+        st.caption(
+            f"{metrics['max_workers']} worker process(es); "
+            f"at most {metrics['max_pending']} sign-ins checked or waiting at once."
+        )
+
+
+def circulation_report():
+    """End-of-term fines and circulation figures across every transaction"""
+    app = st.session_state.app
+    frame = TransactionFrame(app.transactions)
+    summary = frame.summary()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("🔁 Loans", summary['transactions'])
+    with col2:
+        st.metric("⏰ Overdue Now", summary['overdue'])
+    with col3:
+        st.metric("💸 Fines Charged", f"₹{summary['fines_charged']:.2f}")
+    with col4:
+        st.metric("📌 Fines Outstanding", f"₹{summary['fines_outstanding']:.2f}")
+
+    st.markdown("**Days late**")
+    st.bar_chart(frame.days_late_distribution())
+
+    st.markdown("**By programme**")
+    st.dataframe(frame.by_programme(), use_container_width=True)
+
+    top_books = frame.top_books()
+    if top_books:
+        st.markdown("**Most borrowed**")
+        st.dataframe(
+            [
+                {
+                    # Loans without a programme are grouped under the default label.
+                    'Book': (app.get_book(book_id, programme) or app.get_book(book_id) or {}).get('title', book_id),
+                    'Loans': count,
+                }
+                for (programme, book_id), count in top_books
+            ],
+            use_container_width=True,
+        )
+
+
 def view_all_transactions():
     """View and manage all book transactions"""
     st.markdown("### 📈 All Transactions")
+
+    with st.expander("📊 Circulation Report", expanded=False):
+        circulation_report()
     
     # Filter options
     col1, col2, col3 = st.columns(3)
     with col1:
         status_filter = st.selectbox(
             "Filter by status:",
-            ["All"] + ["Borrowed", "Returned", "Overdue"],
+            ["All"] + ["Borrowed", "Returned", "Overdue", "Due in 3 days"],
             key="transaction_status_filter"
         )
     with col2:
@@ -185,12 +265,11 @@ def view_all_transactions():
     
     if status_filter != "All":
         if status_filter == "Overdue":
-            transactions = [t for t in transactions 
-                          if t.get('status') == 'borrowed' 
-                          and 'due_date' in t 
-                          and t.get('due_date') < datetime.now().strftime('%Y-%m-%d')]
+            transactions = st.session_state.app.overdue_loans()
+        elif status_filter == "Due in 3 days":
+            transactions = st.session_state.app.loans_due_within(3)
         else:
-            transactions = [t for t in transactions if t.get('status') == status_filter.lower()]
+            transactions = st.session_state.app.transactions_with_status(status_filter.lower())
     
     if user_filter:
         user_filter = user_filter.lower()
@@ -211,13 +290,14 @@ def view_all_transactions():
     # Display transactions
     if transactions:
         st.markdown(f"**Found {len(transactions)} transactions**")
+        overdue_ids = {t['id'] for t in st.session_state.app.overdue_loans()}
         
         for t in transactions:
             # Determine status color and icon
             if t.get('status') == 'returned':
                 status_icon = "✅"
                 status_color = "#28a745"
-            elif 'due_date' in t and t.get('due_date') < datetime.now().strftime('%Y-%m-%d'):
+            elif t.get('id') in overdue_ids:
                 status_icon = "⏰"
                 status_color = "#dc3545"
             else:
@@ -253,22 +333,11 @@ def view_all_transactions():
                     if t.get('status') == 'borrowed':
                         if st.button("📥 Mark as Returned", key=f"return_{t.get('id')}"):
                             # Find and update the transaction
-                            for trans in st.session_state.app.transactions:
-                                if trans.get('id') == t.get('id'):
-                                    trans['status'] = 'returned'
-                                    trans['return_date'] = datetime.now().strftime('%Y-%m-%d')
-                                    
-                                    # Update book availability
-                                    for program, books in st.session_state.app.books.get('program_books', {}).items():
-                                        for book in books:
-                                            if book.get('id') == t.get('book_id'):
-                                                book['available'] = book.get('available', 0) + 1
-                                                break
-                                    
-                                    st.session_state.app.save_data()
-                                    st.success("Book marked as returned!")
-                                    st.rerun()
-                                    break
+                            trans = st.session_state.app.get_transaction(t.get('id'))
+                            if trans:
+                                st.session_state.app.record_return(trans)
+                                st.success("Book marked as returned!")
+                                st.rerun()
     else:
         st.info("No transactions found matching the current filters.")
 
@@ -311,7 +380,7 @@ def manage_users_admin():
                     
                     if not existing:
                         # Hash the password
-                        password_hash, password_salt = hash_password(new_password)
+                        password_hash = hash_password(new_password)
                         
                         # Create user object
                         user = {
@@ -319,7 +388,6 @@ def manage_users_admin():
                             'name': new_name,
                             'username': new_username,
                             'password_hash': password_hash,
-                            'password_salt': password_salt,
                             'email': new_email if new_email else None,
                             'contact': new_contact if new_contact else None,
                             'programme': new_program if new_program else None
@@ -327,11 +395,29 @@ def manage_users_admin():
                         
                         # Add to appropriate user list
                         role_key = 'students' if new_role == 'student' else 'teachers'
-                        st.session_state.app.users[role_key].append(user)
-                        st.session_state.app.save_data()
+                        st.session_state.app.add_user(role_key, user)
                         st.success(f"✅ User {new_name} added successfully!")
                         st.rerun()
 
+    # Bulk import from CSV
+    with st.expander("📥 Import Users from CSV", expanded=False):
+        st.caption("Columns: id, username, password, name, email, contact, programme")
+        import_role = st.selectbox("Import as", ["student", "teacher"], key="import_user_role")
+        upload = st.file_uploader("CSV file", type=["csv"], key="import_user_file")
+        if upload is not None and st.button("📥 Import Users", key="import_users_button"):
+            rows = list(csv.DictReader(io.StringIO(upload.getvalue().decode("utf-8-sig"))))
+            progress_bar = st.progress(0.0, text="Hashing passwords...")
+
+            def report(done, total):
+                progress_bar.progress(done / total, text=f"Hashing passwords... {done}/{total}")
+
+            role_key = 'students' if import_role == 'student' else 'teachers'
+            added, skipped = st.session_state.app.import_users(role_key, rows, progress=report)
+            progress_bar.empty()
+            st.success(f"✅ Imported {len(added)} user(s)")
+            for record, reason in skipped:
+                st.warning(f"Skipped {record.get('id') or record.get('username') or 'row'}: {reason}")
+
     # User list with edit/delete options
     st.markdown("### 👥 User List")
     
@@ -351,13 +437,9 @@ def manage_users_admin():
     # Search functionality
     search_term = st.text_input("Search users by name, ID, or username")
     if search_term:
-        search_term = search_term.lower()
-        users_to_display = [
-            u for u in users_to_display
-            if (search_term in u.get('name', '').lower() or
-                search_term in u.get('id', '').lower() or
-                search_term in u.get('username', '').lower())
-        ]
+        users_to_display, similar = st.session_state.app.search_users(search_term, users_to_display)
+        if similar and users_to_display:
+            st.caption(f"No exact matches for \"{search_term}\" - showing similar users.")
     
     # Display users
     if users_to_display:
@@ -382,17 +464,13 @@ def manage_users_admin():
                     if st.button("🗑️ Delete", key=f"user_delete_{idx}_{user['id']}"):
                         # Check if user has any active borrows
                         active_borrows = [
-                            t for t in st.session_state.app.transactions 
-                            if t.get('user_id') == user['id'] and t.get('status') == 'borrowed'
+                            t for t in st.session_state.app.user_transactions(user['id'])
+                            if t.get('status') == 'borrowed'
                         ]
                         if active_borrows:
                             st.error("Cannot delete: User has active book borrowings")
                         else:
-                            st.session_state.app.users[user['role']] = [
-                                u for u in st.session_state.app.users[user['role']] 
-                                if u['id'] != user['id']
-                            ]
-                            st.session_state.app.save_data()
+                            st.session_state.app.delete_user(user['role'], user['id'])
                             st.success("User deleted successfully!")
                             st.rerun()
     else:
@@ -421,29 +499,23 @@ def manage_users_admin():
             col1, col2 = st.columns(2)
             with col1:
                 if st.form_submit_button("💾 Save Changes"):
+                    changes = {
+                        'name': new_name,
+                        'username': new_username,
+                        'email': new_email if new_email else None,
+                        'contact': new_contact if new_contact else None,
+                        'programme': new_program if new_program else None
+                    }
+
+                    # Update password if provided
+                    if new_password:
+                        changes['password_hash'] = hash_password(new_password)
+
                     # Find and update the user
-                    for role, users in st.session_state.app.users.items():
-                        for u in users:
-                            if u['id'] == user['id']:
-                                u.update({
-                                    'name': new_name,
-                                    'username': new_username,
-                                    'email': new_email if new_email else None,
-                                    'contact': new_contact if new_contact else None,
-                                    'programme': new_program if new_program else None
-                                })
-                                
-                                # Update password if provided
-                                if new_password:
-                                    password_hash, password_salt = hash_password(new_password)
-                                    u['password_hash'] = password_hash
-                                    u['password_salt'] = password_salt
-                                
-                                st.session_state.app.save_data()
-                                st.success("User updated successfully!")
-                                del st.session_state['editing_user']
-                                st.rerun()
-                                break
+                    if st.session_state.app.update_user(user['role'], user['id'], changes):
+                        st.success("User updated successfully!")
+                        del st.session_state['editing_user']
+                        st.rerun()
             
             with col2:
                 if st.form_submit_button("❌ Cancel"):
@@ -490,13 +562,7 @@ def manage_books_admin():
                     
                     # Add to appropriate book list
                     program_key = program if program else 'general'
-                    if 'program_books' not in st.session_state.app.books:
-                        st.session_state.app.books['program_books'] = {}
-                    if program_key not in st.session_state.app.books['program_books']:
-                        st.session_state.app.books['program_books'][program_key] = []
-                    
-                    st.session_state.app.books['program_books'][program_key].append(new_book)
-                    st.session_state.app.save_data()
+                    st.session_state.app.add_book(program_key, new_book)
                     st.success("✅ Book added successfully!")
                     st.rerun()
 
@@ -514,13 +580,9 @@ def manage_books_admin():
     
     # Apply search filter
     if search_term:
-        search_term = search_term.lower()
-        filtered_books = [
-            b for b in all_books
-            if (search_term in b.get('title', '').lower() or
-                search_term in b.get('author', '').lower() or
-                search_term in b.get('id', '').lower())
-        ]
+        filtered_books, similar = st.session_state.app.search_books(search_term, all_books)
+        if similar and filtered_books:
+            st.caption(f"No exact matches for \"{search_term}\" - showing similar books.")
     else:
         filtered_books = all_books
 
@@ -549,19 +611,12 @@ def manage_books_admin():
                     
                     if st.button("🗑️ Delete", key=f"book_delete_{idx}_{book['id']}"):
                         # Check if any copies are borrowed
-                        borrowed = any(
-                            t['book_id'] == book['id'] and t['status'] == 'borrowed'
-                            for t in st.session_state.app.transactions
-                        )
+                        borrowed = bool(st.session_state.app.active_loans(book))
                         if borrowed:
                             st.error("Cannot delete: Some copies are currently borrowed")
                         else:
                             program = book.get('program', 'general')
-                            st.session_state.app.books['program_books'][program] = [
-                                b for b in st.session_state.app.books['program_books'][program]
-                                if b['id'] != book['id']
-                            ]
-                            st.session_state.app.save_data()
+                            st.session_state.app.delete_book(program, book['id'])
                             st.success("Book deleted successfully!")
                             st.rerun()
     else:
@@ -593,23 +648,18 @@ def manage_books_admin():
             with col1:
                 if st.form_submit_button("💾 Save Changes"):
                     # Find and update the book
-                    for program, books in st.session_state.app.books.get('program_books', {}).items():
-                        for b in books:
-                            if b['id'] == book['id']:
-                                b.update({
-                                    'title': new_title,
-                                    'author': new_author,
-                                    'category': new_category,
-                                    'copies': new_copies,
-                                    'available': new_available,
-                                    'isbn': new_isbn,
-                                    'description': new_description
-                                })
-                                st.session_state.app.save_data()
-                                st.success("Book updated successfully!")
-                                del st.session_state['editing_book']
-                                st.rerun()
-                                break
+                    if st.session_state.app.update_book(book['id'], {
+                        'title': new_title,
+                        'author': new_author,
+                        'category': new_category,
+                        'copies': new_copies,
+                        'available': new_available,
+                        'isbn': new_isbn,
+                        'description': new_description
+                    }, programme=book.get('programme')):
+                        st.success("Book updated successfully!")
+                        del st.session_state['editing_book']
+                        st.rerun()
             
             with col2:
                 if st.form_submit_button("❌ Cancel"):
@@ -1,17 +1,28 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import json
+import atexit
 import os
 from datetime import datetime, timedelta
 import re
 import html
-import smtplib
-import ssl
-from email.message import EmailMessage
+import bisect
+import heapq
+import sys
+import threading
+from functools import lru_cache, wraps
+from typing import Callable, Iterable
 
 from admin_portal import admin_dashboard
+from catalog_search import FUZZY_BOOK_FIELDS, FUZZY_USER_FIELDS, CatalogSearchIndex, TrigramIndex
+from circulation import DueDateIndex, FineAccrualJob, days_overdue, fine_for
+from credential_service import CredentialServiceBusy, get_credential_service
+from dashboard_stats import DashboardStats
+from notifications import EmailOutbox, build_hold_message, build_reservation_message
 from program_catalog import PROGRAM_CATEGORIES, all_programmes, programme_category
-from security_utils import ensure_password_fields, hash_password, verify_password
+from ledger import TransactionLedger
+from records import Book, BookTemplate, Programme, ProgramBook, Reservation, User, book_key, loaned_book_key
+from security_utils import dummy_password_hash, ensure_password_fields_many, hash_password, needs_rehash
+from storage import StorageConflict, create_storage
 
 # Page config
 st.set_page_config(
@@ -1830,69 +1841,39 @@ def _ensure_subject_tag(book: dict) -> str | None:
     return subject
 
 
-def _build_unique_program_title(
-    base_title: str | None,
-    programme: str,
-    slug: str,
-    signature_base: str,
-) -> str:
-    """Ensure programme-specific titles stay readable and distinct."""
-
-    title = base_title.strip() if isinstance(base_title, str) else ""
-    programme_label = re.sub(r"\s+", " ", programme).strip() if isinstance(programme, str) else slug
-
-    if title:
-        # Avoid duplicating programme info if already present.
-        if programme_label and programme_label.lower() in title.lower():
-            return title
-        return f"{title} ({programme_label})" if programme_label else title
-
-    programme_label = programme_label or slug or "Programme"
-    return f"{programme_label} Resource {signature_base}"
-
-
-def _make_program_book_entry(template: dict, programme: str, category: str, slug: str | None = None) -> dict:
-    slug = slug or _slugify_program(programme)
-    entry = template.copy()
-    base_id = entry['id']
-    entry['id'] = f"{base_id}_{slug}"
-    signature_base = re.sub(r"[^A-Z0-9]", "", base_id.upper()) or base_id.upper()
-    base_title = entry.get('title') if isinstance(entry.get('title'), str) else None
-    entry['original_title'] = base_title
-    entry['title'] = _build_unique_program_title(base_title, programme, slug, signature_base)
-    entry['title_signature'] = f"{slug}:{signature_base}"
-    copies = max(int(entry.get('copies', 1)), 1)
-    entry['copies'] = copies
-    entry['available'] = copies
-    entry['programme'] = programme
-    entry['program_category'] = category
-    entry['catalog_type'] = 'program'
-    entry['subject'] = _resolve_subject(base_id, template)
-    pdf_url = entry.get('pdf_url')
-    if isinstance(pdf_url, str) and pdf_url.strip():
-        clean_url = pdf_url.strip()
-        delimiter = '&' if '?' in clean_url else '?'
-        entry['pdf_url'] = f"{clean_url}{delimiter}programme={slug}"
-    else:
-        entry.pop('pdf_url', None)
-    return entry
+@lru_cache(maxsize=None)
+def _book_template_records() -> dict[str, tuple[BookTemplate, ...]]:
+    """Shared template records for every category's default books.
+
+    STEM books are stocked by every category, so their records are built once
+    and reused.
+    """
+    records: dict[int, BookTemplate] = {}
+
+    def record(template: dict) -> BookTemplate:
+        if id(template) not in records:
+            records[id(template)] = BookTemplate(template, _resolve_subject(template['id'], template))
+        return records[id(template)]
+
+    stem = tuple(record(template) for template in DEFAULT_CATEGORY_BOOKS.get("STEM", []))
+    return {
+        category: tuple(record(template) for template in DEFAULT_CATEGORY_BOOKS.get(category, [])) + stem
+        for category in PROGRAM_CATEGORIES
+    }
+
+
+@lru_cache(maxsize=None)
+def _programme_record(programme: str, category: str) -> Programme:
+    return Programme(programme, category, _slugify_program(programme))
 
 
 def build_default_program_books():
     program_books = {}
-    global_stem_templates = DEFAULT_CATEGORY_BOOKS.get("STEM", [])
+    templates = _book_template_records()
     for category, programmes in PROGRAM_CATEGORIES.items():
-        base_templates = DEFAULT_CATEGORY_BOOKS.get(category, [])
-        if global_stem_templates:
-            templates = list(base_templates) + list(global_stem_templates)
-        else:
-            templates = base_templates
         for programme in programmes:
-            slug = _slugify_program(programme)
-            program_books[programme] = [
-                _make_program_book_entry(template, programme, category, slug)
-                for template in templates
-            ]
+            record = _programme_record(programme, category)
+            program_books[programme] = [ProgramBook(template, record) for template in templates[category]]
     return program_books
 
 
@@ -1902,11 +1883,7 @@ def programme_books(programme: str) -> list[dict]:
         return books
 
     if programme in st.session_state.app.books.get('program_books', {}):
-        st.session_state.app.seed_program_books()
-        st.session_state.app.normalize_book_metadata()
-        books = st.session_state.app.books.get('program_books', {}).get(programme, [])
-        if books:
-            st.session_state.app.save_data()
+        books = st.session_state.app.reseed_programme(programme)
     return books
 
 
@@ -1966,105 +1943,32 @@ def borrowable_collection_items() -> list[dict]:
     return items
 
 
-def all_subjects() -> list[str]:
-    subjects = set()
-
-    for programme_books in st.session_state.app.books.get('program_books', {}).values():
-        for book in programme_books:
-            subject = _ensure_subject_tag(book)
-            if subject:
-                subjects.add(subject)
-
-    for book in st.session_state.app.books.get('teacher_books', []):
-        subject = _ensure_subject_tag(book)
-        if subject:
-            subjects.add(subject)
-
-    for collection_entries in collection_catalog().values():
-        for item in collection_entries:
-            subject = _ensure_subject_tag(item)
-            if subject:
-                subjects.add(subject)
-
-    return sorted(subjects)
+PAGE_SIZE_OPTIONS = [10, 20, 50, 100]
 
 
-def _email_setting(name: str) -> str | None:
-    value = os.getenv(name)
-    return value.strip() if isinstance(value, str) and value.strip() else None
+def default_page_size() -> int:
+    """Book cards per page, overridable with BOOKFLOW_PAGE_SIZE."""
+    try:
+        size = int(os.getenv('BOOKFLOW_PAGE_SIZE', '20'))
+    except ValueError:
+        return 20
+    return size if size > 0 else 20
 
 
-def send_reservation_email(
+def queue_reservation_email(
     to_email: str,
     user_name: str,
     book: dict,
     reservation: dict,
-) -> tuple[bool, str | None]:
-    smtp_server = _email_setting("BOOKFLOW_SMTP_SERVER")
-    smtp_port = _email_setting("BOOKFLOW_SMTP_PORT") or "465"
-    smtp_username = _email_setting("BOOKFLOW_SMTP_USERNAME")
-    smtp_password = _email_setting("BOOKFLOW_SMTP_PASSWORD")
-    sender_email = _email_setting("BOOKFLOW_EMAIL_SENDER") or smtp_username
-
-    if not all([smtp_server, smtp_username, smtp_password, sender_email]):
-        return False, (
-            "SMTP settings are incomplete. Set BOOKFLOW_SMTP_SERVER, BOOKFLOW_SMTP_PORT, "
-            "BOOKFLOW_SMTP_USERNAME, BOOKFLOW_SMTP_PASSWORD, and BOOKFLOW_EMAIL_SENDER."
-        )
-
-    try:
-        port = int(smtp_port)
-    except ValueError:
-        return False, f"Invalid SMTP port: {smtp_port}"
-
-    book_title = book.get('title', 'Requested Book')
-    programme = book.get('programme') or 'General Library'
-    subject = f"Reservation confirmed for \"{book_title}\""
-    reserved_at = reservation.get('reserved_at', datetime.now().strftime('%Y-%m-%d %H:%M'))
-
-    message = EmailMessage()
-    message["Subject"] = subject
-    message["From"] = sender_email
-    message["To"] = to_email
-    message.set_content(
-        f"Hello {user_name},\n\n"
-        f"We've recorded your reservation for \"{book_title}\" in the BookFlow library.\n\n"
-        f"Reservation details:\n"
-        f"• Programme: {programme}\n"
-        f"• Reservation ID: {reservation.get('id')}\n"
-        f"• Reserved on: {reserved_at}\n\n"
-        "We'll notify you as soon as a copy becomes available.\n\n"
-        "Thank you for using BookFlow!"
-    )
-
-    try:
-        context = ssl.create_default_context()
-        if port == 465:
-            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                server.login(smtp_username, smtp_password)
-                server.send_message(message)
-        else:
-            with smtplib.SMTP(smtp_server, port, timeout=20) as server:
-                server.ehlo()
-                server.starttls(context=context)
-                server.ehlo()
-                server.login(smtp_username, smtp_password)
-                server.send_message(message)
-        return True, None
-    except smtplib.SMTPAuthenticationError as exc:
-        detail = None
-        if getattr(exc, "smtp_error", None):
-            try:
-                detail = exc.smtp_error.decode("utf-8", errors="ignore")
-            except AttributeError:
-                detail = str(exc.smtp_error)
-        return False, (
-            f"Authentication failed: {detail.strip()}" if detail else "Authentication failed: check username/app password."
-        )
-    except smtplib.SMTPConnectError as exc:
-        return False, f"Connection error: {exc.smtp_error.decode() if getattr(exc, 'smtp_error', None) else exc}"
-    except Exception as exc:  # pragma: no cover - depends on external SMTP
-        return False, str(exc)
+) -> tuple[str, str | None]:
+    """Queue a reservation confirmation; returns ``(status, error)``."""
+    outbox = st.session_state.app.outbox
+    error = outbox.configure()
+    if error:
+        return 'failed', error
+    message = build_reservation_message(outbox.sender, to_email, user_name, book, reservation)
+    entry = outbox.enqueue(message, kind='reservation', reference=reservation.get('id'))
+    return entry['status'], None
 
 
 def _render_programme_carousel(programme: str, books: list[dict], slider_key: str) -> None:
@@ -2081,8 +1985,8 @@ def _render_programme_carousel(programme: str, books: list[dict], slider_key: st
         title = html.escape(book.get("title", "Untitled"))
         author = html.escape(book.get("author", "Unknown"))
         book_id = html.escape(book.get("id", ""))
-        copies = int(book.get("copies", 0) or 0)
-        available = int(book.get("available", 0) or 0)
+        copies = book.get("copies", 0)
+        available = book.get("available", 0)
         pdf_url = (book.get("pdf_url") or "").strip()
         pdf_html = (
             f"<a class=\"bf-link\" href=\"{html.escape(pdf_url)}\" target=\"_blank\">📄 Download</a>"
@@ -2242,40 +2146,359 @@ def _render_programme_carousel(programme: str, books: list[dict], slider_key: st
     )
 
 
+def _mutation(method):
+    """Run a ``BookFlowApp`` method that changes stored data.
+
+    The method runs under the app lock and the storage's cross-process lock.
+    If another process saved since this one last read the data, it is
+    reloaded first so the change applies to the latest state. Should the save
+    still conflict (a writer that ignored the lock), the data is reloaded and
+    the method runs once more. Side effects registered with ``_after_save``
+    run once, after the run whose save went through.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._mutating, 'active', False):
+            return method(self, *args, **kwargs)
+        reload = False
+        for attempt in range(2):
+            pending: list[Callable[[], object]] = []
+            with self.lock, self.storage.locked():
+                self._mutating.active = True
+                self._mutating.after_save = pending
+                try:
+                    if reload or self.storage.changed():
+                        self._load_data()
+                    result = method(self, *args, **kwargs)
+                except StorageConflict:
+                    if attempt:
+                        raise
+                    reload = True
+                    continue
+                finally:
+                    self._mutating.active = False
+                    self._mutating.after_save = None
+            for action in pending:
+                action()
+            return result
+    return wrapper
+
+
 class BookFlowApp:
-    def __init__(self):
+    # Ordered migration registry: each step brings stored data up to its
+    # version. Add a step (and so bump SCHEMA_VERSION) whenever the stored
+    # shape or the seeded catalogue defaults change; data already at the
+    # current version loads without walking the dataset.
+    SCHEMA_MIGRATIONS = (
+        (1, 'migrate_user_contact_fields'),
+        (2, 'migrate_user_password_fields'),
+        (3, 'migrate_program_books'),
+        (4, 'migrate_user_program_fields'),
+        (5, 'seed_program_books'),
+        (6, 'seed_collection_catalog'),
+        (7, 'normalize_book_metadata'),
+        (8, 'migrate_reservation_queue_fields'),
+    )
+    SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+    # How long a returned copy is kept for the next reader in the queue.
+    RESERVATION_HOLD_DAYS = 3
+
+    def __init__(self, storage=None, credentials=None, outbox=None):
         self.data_file = "bookflow_data.json"
+        self.storage = storage or create_storage(self.data_file)
+        self.credentials = credentials or get_credential_service()
+        self.outbox = outbox or EmailOutbox(os.getenv('BOOKFLOW_OUTBOX_PATH', 'bookflow_outbox.json'))
+        if self.outbox.pending_count():
+            # Resume delivery of mail queued before a restart.
+            self.outbox.start()
+        dummy_password_hash()
+        self._rehashing: set[str] = set()
+        # One instance is shared by every session in the process, so all
+        # mutations (and reloads) go through this lock.
+        self.lock = threading.RLock()
+        self._mutating = threading.local()
         self.reservations: list[dict] = []
         self.load_data()
+        self.fine_job = FineAccrualJob(
+            self.accrue_fines, interval=float(os.getenv('BOOKFLOW_FINE_ACCRUAL_INTERVAL', '3600'))
+        )
+        self.fine_job.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """Stop background work, letting a fine accrual in progress finish its save."""
+        self.fine_job.stop()
     
     def load_data(self):
-        """Load data from JSON file"""
-        try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-                self.users = data.get('users', self.get_default_users())
-                self.books = data.get('books', self.get_default_books())
-                self.transactions = data.get('transactions', [])
-                self.reservations = data.get('reservations', [])
-                self.migrate_user_contact_fields()
-                self.migrate_user_password_fields()
-                self.migrate_program_books()
-                self.migrate_user_program_fields()
-                self.seed_program_books()
-                self.seed_collection_catalog()
-                self.normalize_book_metadata()
-        except FileNotFoundError:
+        """Load data from the configured storage backend"""
+        with self.lock, self.storage.locked():
+            self._load_data()
+
+    def refresh_if_changed(self) -> bool:
+        """Reload when another process saved since we last read the data."""
+        if not self.storage.changed():
+            return False
+        with self.lock, self.storage.locked():
+            if not self.storage.changed():
+                return False
+            self._load_data()
+            return True
+
+    def _load_data(self):
+        data = self.storage.load()
+        if data is not None:
+            # Defaults are only built when missing: they hash passwords and
+            # generate the whole programme catalogue.
+            self.users = data['users'] if 'users' in data else self.get_default_users()
+            self.books = data['books'] if 'books' in data else self.get_default_books()
+            self.transactions = data.get('transactions', [])
+            self.reservations = data.get('reservations', [])
+            self.schema_version = int(data.get('schema_version', 0))
+        else:
             self.users = self.get_default_users()
             self.books = self.get_default_books()
             self.transactions = []
             self.reservations = []
-            self.migrate_user_password_fields()
-            self.migrate_program_books()
-            self.migrate_user_program_fields()
-            self.seed_program_books()
-            self.seed_collection_catalog()
-            self.normalize_book_metadata()
+            self.schema_version = 0
+
+        if self.run_migrations() or data is None:
             self.save_data()
+        self.compact_program_books()
+        self.wrap_records()
+        self.rebuild_indexes()
+
+    def rebuild_indexes(self):
+        """Rebuild the primary-key lookups from the loaded data.
+
+        Every mutation method keeps these in step, so lookups by id never
+        scan the underlying lists.
+        """
+        self._books_by_key: dict[tuple[str, str], dict] = {}
+        for _, book in self.iter_program_books():
+            self._books_by_key.setdefault(book_key(book), book)
+        for book in self.books.get('teacher_books', []):
+            self._books_by_key.setdefault(book_key(book), book)
+        for items in self.books.get('collection_catalog', {}).values():
+            for item in items:
+                self._books_by_key.setdefault(book_key(item), item)
+        self.search_index = CatalogSearchIndex(self._books_by_key.values(), key=book_key)
+        self.fuzzy_books = TrigramIndex(FUZZY_BOOK_FIELDS, self._books_by_key.values(), key=book_key)
+        self._subject_index = None
+
+        self.fuzzy_users = TrigramIndex(FUZZY_USER_FIELDS)
+        self._users_by_id: dict[str, dict] = {}
+        self._user_roles: dict[str, str] = {}
+        self._users_by_login: dict[tuple[str, str], dict] = {}
+        for role_key, users in self.users.items():
+            for user in users:
+                self._index_user(role_key, user)
+
+        self._transactions_by_id: dict = {}
+        self._transactions_by_user: dict[str, list[dict]] = {}
+        self._active_loans_by_book: dict[tuple[str, str], dict] = {}
+        self._transactions_by_status: dict[str, dict] = {}
+        self._due_index = DueDateIndex()
+        for transaction in self.transactions:
+            self._index_transaction(transaction)
+
+        self._active_reservations: dict[tuple, dict] = {}
+        self._reservations_by_seq: dict[int, dict] = {}
+        self._reservation_queues: dict[tuple[str, str], list[int]] = {}
+        self._hold_expiry: list[tuple[str, int]] = []
+        for record in self.reservations:
+            self._index_reservation(record)
+        self._next_reservation_seq = max(self._reservations_by_seq, default=0) + 1
+
+        if not hasattr(self, 'stats'):
+            self.stats = DashboardStats()
+        self.refresh_stats()
+
+    def refresh_stats(self) -> None:
+        """Recount the dashboard totals from the loaded data."""
+        self.stats.rebuild(self.books.get('program_books', {}), self.users, self.transactions)
+
+    def _index_reservation(self, record: dict) -> None:
+        status = record.get('status', 'waiting')
+        self._reservations_by_seq[record['seq']] = record
+        if status in ('waiting', 'held'):
+            self._active_reservations.setdefault((record.get('user_id'), loaned_book_key(record)), record)
+        if status == 'waiting':
+            bisect.insort(self._reservation_queues.setdefault(loaned_book_key(record), []), record['seq'])
+        elif status == 'held':
+            heapq.heappush(self._hold_expiry, (record['hold_expires_at'], record['seq']))
+
+    def _close_reservation(self, record: dict, status: str) -> None:
+        """Take ``record`` out of its queue or hold and give it a final status."""
+        if record.get('status', 'waiting') == 'waiting':
+            queue = self._reservation_queues.get(loaned_book_key(record), [])
+            index = bisect.bisect_left(queue, record['seq'])
+            if index < len(queue) and queue[index] == record['seq']:
+                del queue[index]
+            if not queue:
+                self._reservation_queues.pop(loaned_book_key(record), None)
+        key = (record.get('user_id'), loaned_book_key(record))
+        if self._active_reservations.get(key) is record:
+            del self._active_reservations[key]
+        record['status'] = status
+        record['closed_at'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+
+    def _index_user(self, role_key: str, user: dict) -> None:
+        if self._users_by_id.setdefault(user['id'], user) is user:
+            self.fuzzy_users.add(user)
+        self._user_roles.setdefault(user['id'], role_key)
+        self._users_by_login.setdefault((role_key, user['username']), user)
+
+    def _unindex_user(self, role_key: str, user: dict) -> None:
+        if self._users_by_id.get(user['id']) is user:
+            del self._users_by_id[user['id']]
+            del self._user_roles[user['id']]
+            self.fuzzy_users.remove(user['id'])
+        if self._users_by_login.get((role_key, user['username'])) is user:
+            del self._users_by_login[(role_key, user['username'])]
+
+    def _index_transaction(self, transaction: dict) -> None:
+        self._transactions_by_id[transaction['id']] = transaction
+        self._transactions_by_user.setdefault(transaction['user_id'], []).append(transaction)
+        self._transactions_by_status.setdefault(transaction['status'], {})[transaction['id']] = transaction
+        if transaction['status'] == 'borrowed':
+            self._active_loans_by_book.setdefault(loaned_book_key(transaction), {})[transaction['id']] = transaction
+            if transaction.get('due_date'):
+                self._due_index.add(transaction)
+
+    def _set_transaction_status(self, transaction: dict, status: str) -> None:
+        previous = transaction['status']
+        self._transactions_by_status.get(previous, {}).pop(transaction['id'], None)
+        self._transactions_by_status.setdefault(status, {})[transaction['id']] = transaction
+        if previous == 'borrowed':
+            loans = self._active_loans_by_book.get(loaned_book_key(transaction), {})
+            loans.pop(transaction['id'], None)
+            if not loans:
+                self._active_loans_by_book.pop(loaned_book_key(transaction), None)
+            self._due_index.remove(transaction['id'])
+        transaction['status'] = status
+
+    def get_book(self, book_id: str, programme: str | None = None) -> dict | None:
+        """Return a book by id; programme books also need their programme."""
+        return self._books_by_key.get((programme or '', book_id))
+
+    @staticmethod
+    def _rank(records: Iterable[dict], ranked_keys: Iterable, key) -> list[dict]:
+        """Keep the ``records`` whose key is in ``ranked_keys``, in that order."""
+        ranking = {record_key: rank for rank, record_key in enumerate(ranked_keys)}
+        return sorted((r for r in records if key(r) in ranking), key=lambda r: ranking[key(r)])
+
+    def search_books(self, query: str, books: Iterable[dict] | None = None) -> tuple[list[dict], bool]:
+        """Return the ``books`` (default: the catalogue) matching ``query``, best first.
+
+        When nothing matches exactly, books whose title, author or subject
+        resemble ``query`` are returned instead and the flag is ``True``.
+        """
+        books = list(self._books_by_key.values() if books is None else books)
+        matches = self._rank(books, self.search_index.search(query), book_key)
+        if matches:
+            return matches, False
+        similar = (key for key, _ in self.fuzzy_books.search(query, limit=None))
+        return self._rank(books, similar, book_key), True
+
+    def search_users(self, query: str, users: Iterable[dict]) -> tuple[list[dict], bool]:
+        """Return the ``users`` whose name, id or username contain ``query``.
+
+        When none do, users with similar names or usernames are returned
+        instead, most similar first, and the flag is ``True``.
+        """
+        users = list(users)
+        term = query.lower()
+        matches = [
+            u for u in users
+            if term in u.get('name', '').lower()
+            or term in u.get('id', '').lower()
+            or term in u.get('username', '').lower()
+        ]
+        if matches:
+            return matches, False
+        similar = (user_id for user_id, _ in self.fuzzy_users.search(query, limit=None))
+        return self._rank(users, similar, lambda u: u.get('id')), True
+
+    def _subject_facet_index(self) -> dict[str, dict]:
+        """Map lowercased subjects to their label, book keys and books.
+
+        Built on first use and dropped whenever the catalogue is edited, so
+        reruns reuse it instead of re-tagging every book.
+        """
+        index = self._subject_index
+        if index is not None:
+            return index
+        with self.lock:
+            if self._subject_index is not None:
+                return self._subject_index
+            index = {}
+            catalogue = [book for _, book in self.iter_program_books()]
+            catalogue.extend(self.books.get('teacher_books', []))
+            for items in self.books.get('collection_catalog', {}).values():
+                catalogue.extend(items)
+            for book in catalogue:
+                subject = _ensure_subject_tag(book)
+                if not subject:
+                    continue
+                facet = index.setdefault(subject.lower(), {'subject': subject, 'keys': set(), 'books': []})
+                facet['keys'].add(book_key(book))
+                facet['books'].append(book)
+            self._subject_index = index
+            return index
+
+    def subject_facets(self) -> dict[str, int]:
+        """Return each subject with its number of catalogue entries, sorted by name."""
+        facets = {facet['subject']: len(facet['books']) for facet in self._subject_facet_index().values()}
+        return dict(sorted(facets.items()))
+
+    def subject_book_keys(self, subject: str) -> set[tuple[str, str]]:
+        facet = self._subject_facet_index().get(subject.lower())
+        return facet['keys'] if facet else set()
+
+    def books_with_subject(self, subject: str, catalog_type: str | None = None) -> list[dict]:
+        facet = self._subject_facet_index().get(subject.lower())
+        if not facet:
+            return []
+        if catalog_type is None:
+            return list(facet['books'])
+        return [book for book in facet['books'] if book.get('catalog_type') == catalog_type]
+
+    def get_user(self, user_id: str) -> dict | None:
+        return self._users_by_id.get(user_id)
+
+    def find_user(self, role_key: str, username: str) -> dict | None:
+        return self._users_by_login.get((role_key, username))
+
+    def get_transaction(self, transaction_id) -> dict | None:
+        return self._transactions_by_id.get(transaction_id)
+
+    def user_transactions(self, user_id: str) -> list[dict]:
+        return list(self._transactions_by_user.get(user_id, ()))
+
+    def active_loans(self, book: dict) -> list[dict]:
+        return list(self._active_loans_by_book.get(book_key(book), {}).values())
+
+    def active_loan(self, user_id: str, book: dict) -> dict | None:
+        for transaction in self.active_loans(book):
+            if transaction['user_id'] == user_id:
+                return transaction
+        return None
+
+    def transactions_with_status(self, status: str) -> list[dict]:
+        return list(self._transactions_by_status.get(status, {}).values())
+
+    def run_migrations(self) -> bool:
+        """Apply every registered migration newer than ``schema_version``.
+
+        Migrations only mutate in-memory state; the caller saves once
+        afterwards. Returns True when any migration ran.
+        """
+        pending = [name for version, name in self.SCHEMA_MIGRATIONS if version > self.schema_version]
+        for name in pending:
+            getattr(self, name)()
+        self.schema_version = max(self.schema_version, self.SCHEMA_VERSION)
+        return bool(pending)
     
     def migrate_user_contact_fields(self):
         """Add contact and email fields to existing users if missing"""
@@ -2289,62 +2512,435 @@ class BookFlowApp:
                     if 'email' not in user:
                         user['email'] = 'Not provided'
                         updated = True
-        if updated:
-            self.save_data()
+        return updated
 
-    def migrate_user_password_fields(self):
-        """Ensure all stored users have hashed passwords."""
+    def migrate_reservation_queue_fields(self):
+        """Number reservations so each book's waitlist keeps its order."""
+        next_seq = max((record.get('seq', 0) for record in self.reservations), default=0) + 1
         updated = False
-        for role, users in self.users.items():
-            for user in users:
-                if ensure_password_fields(user):
-                    updated = True
+        for record in self.reservations:
+            if 'seq' not in record:
+                record['seq'] = next_seq
+                next_seq += 1
+                updated = True
+            record.setdefault('status', 'waiting')
+        return updated
 
-        if updated:
-            self.save_data()
+    def migrate_user_password_fields(self):
+        """Ensure all stored users have hashed passwords."""
+        return ensure_password_fields_many(user for users in self.users.values() for user in users) > 0
 
     def save_data(self):
-        """Save data to JSON file"""
+        """Save the full data set to the storage backend"""
         data = {
+            'schema_version': self.schema_version,
             'users': self.users,
             'books': self.books,
             'transactions': self.transactions,
             'reservations': self.reservations,
         }
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f, indent=4)
+        self.storage.save(data)
+
+    def persist(
+        self,
+        *,
+        users: Iterable[tuple[str, dict]] = (),
+        books: Iterable[dict] = (),
+        transactions: Iterable[dict] = (),
+        reservations: Iterable[dict] = (),
+        deleted_users: Iterable[tuple[str, str]] = (),
+        deleted_books: Iterable[dict] = (),
+    ) -> None:
+        """Persist only the records touched by a mutation.
+
+        ``users`` and ``deleted_users`` take ``(role_key, user)`` and
+        ``(role_key, user_id)`` pairs; books are passed as the book dicts
+        themselves. Backends without record-level writes fall back to a full
+        ``save_data``.
+        """
+        if not self.storage.supports_record_writes:
+            self.save_data()
+            return
+        self.storage.write(
+            users=users,
+            books=[(*self._book_location(book), book) for book in books],
+            transactions=transactions,
+            reservations=reservations,
+            deleted_users=deleted_users,
+            deleted_books=[(*self._book_location(book), book['id']) for book in deleted_books],
+        )
 
-    def update_user_email(self, user_id: str, role: str, email: str | None) -> None:
-        role_key = (
+    @staticmethod
+    def _book_location(book: dict) -> tuple[str, str]:
+        catalog_type = book.get('catalog_type')
+        if catalog_type == 'teacher':
+            return 'teacher_books', ''
+        if catalog_type == 'collection':
+            return 'collection_catalog', book.get('collection') or ''
+        return 'program_books', book.get('programme') or 'general'
+
+    @staticmethod
+    def role_key(role: str) -> str:
+        return (
             'students'
             if role == 'student'
             else 'teachers'
             if role == 'teacher'
             else 'admin'
         )
+
+    def update_user_email(self, user_id: str, role: str, email: str | None) -> None:
         new_value = email.strip() if isinstance(email, str) and email.strip() else 'Not provided'
-        for user in self.users.get(role_key, []):
-            if user.get('id') == user_id:
-                user['email'] = new_value
-                break
-        self.save_data()
+        self.update_user(self.role_key(role), user_id, {'email': new_value})
+
+    @_mutation
+    def add_user(self, role_key: str, user: dict) -> None:
+        user = User.from_dict(user)
+        with self.lock:
+            self.users.setdefault(role_key, []).append(user)
+            self._index_user(role_key, user)
+            self.stats.users_added(role_key)
+            self.persist(users=[(role_key, user)])
+
+    def import_users(self, role_key: str, records: Iterable[dict], progress=None) -> tuple[list[dict], list[tuple[dict, str]]]:
+        """Add many users at once, hashing their passwords in parallel.
+
+        Each record needs ``id``, ``username``, ``name`` and a plaintext
+        ``password``. Returns the added users and ``(record, reason)`` pairs
+        for the rows that were skipped.
+        """
+        accepted: list[dict] = []
+        skipped: list[tuple[dict, str]] = []
+        seen_ids: set[str] = set()
+        seen_usernames: set[str] = set()
+        for record in records:
+            user = {key: value.strip() if isinstance(value, str) else value for key, value in record.items()}
+            user = {key: value for key, value in user.items() if value not in (None, '')}
+            missing = [field for field in ('id', 'username', 'name', 'password') if not user.get(field)]
+            if missing:
+                skipped.append((record, f"missing {', '.join(missing)}"))
+                continue
+            user['id'] = user['id'].upper()
+            if user['id'] in seen_ids or self.get_user(user['id']):
+                skipped.append((record, f"ID {user['id']} already exists"))
+                continue
+            if user['username'] in seen_usernames or self.find_user(role_key, user['username']):
+                skipped.append((record, f"username {user['username']} is already taken"))
+                continue
+            user.pop('password_hash', None)
+            user.pop('password_salt', None)
+            seen_ids.add(user['id'])
+            seen_usernames.add(user['username'])
+            accepted.append(user)
+
+        # Hash outside the lock so other sessions keep working meanwhile.
+        ensure_password_fields_many(accepted, progress=progress)
+        accepted = [User.from_dict(user) for user in accepted]
+        added = self._add_imported_users(role_key, accepted, skipped)
+        return added, skipped
+
+    @_mutation
+    def _add_imported_users(self, role_key: str, accepted: list[dict], skipped: list) -> list[dict]:
+        added: list[dict] = []
+        for user in accepted:
+            if user['id'] in self._users_by_id or (role_key, user['username']) in self._users_by_login:
+                skipped.append((user, 'added by someone else during the import'))
+                continue
+            self.users.setdefault(role_key, []).append(user)
+            self._index_user(role_key, user)
+            added.append(user)
+        if added:
+            self.stats.users_added(role_key, len(added))
+            self.persist(users=[(role_key, user) for user in added])
+        return added
+
+    @_mutation
+    def update_user(self, role_key: str, user_id: str, changes: dict) -> dict | None:
+        with self.lock:
+            user = self._users_by_id.get(user_id)
+            if user is None or self._user_roles.get(user_id) != role_key:
+                return None
+            self._unindex_user(role_key, user)
+            user.update(changes)
+            if 'password_hash' in changes and 'password_salt' not in changes:
+                # New hashes are self-describing; a leftover salt belongs to the old one.
+                user.pop('password_salt', None)
+            self._index_user(role_key, user)
+            self.persist(users=[(role_key, user)])
+            return user
+
+    @_mutation
+    def delete_user(self, role_key: str, user_id: str) -> None:
+        with self.lock:
+            user = self._users_by_id.get(user_id)
+            if user is not None and self._user_roles.get(user_id) == role_key:
+                self._unindex_user(role_key, user)
+            remaining = [u for u in self.users.get(role_key, []) if u['id'] != user_id]
+            self.stats.users_removed(role_key, len(self.users.get(role_key, [])) - len(remaining))
+            self.users[role_key] = remaining
+            self.persist(deleted_users=[(role_key, user_id)])
+
+    @_mutation
+    def add_book(self, program_key: str, book: dict) -> None:
+        book = Book.from_dict(book)
+        with self.lock:
+            # Migrations no longer run on every load, so new books are
+            # normalized as they are added.
+            self.normalize_program_book(book, program_key)
+            self.books.setdefault('program_books', {}).setdefault(program_key, []).append(book)
+            self.stats.books_added()
+            if self._books_by_key.setdefault(book_key(book), book) is book:
+                self.search_index.add(book)
+                self.fuzzy_books.add(book)
+            self._subject_index = None
+            self.persist(books=[book])
+
+    @_mutation
+    def update_book(self, book_id: str, changes: dict, programme: str | None = None) -> dict | None:
+        with self.lock:
+            book = self.get_book(book_id, programme)
+            if book is None:
+                return None
+            book.update(changes)
+            if book.get('catalog_type') == 'program':
+                self.normalize_program_book(book, book['programme'])
+            self.search_index.update(book)
+            self.fuzzy_books.update(book)
+            self._subject_index = None
+            self.persist(books=[book])
+            return book
+
+    @_mutation
+    def delete_book(self, program_key: str, book_id: str) -> None:
+        with self.lock:
+            program_books = self.books.get('program_books', {})
+            removed = [b for b in program_books.get(program_key, []) if b['id'] == book_id]
+            program_books[program_key] = [b for b in program_books.get(program_key, []) if b['id'] != book_id]
+            for book in removed:
+                key = book_key(book)
+                if self._books_by_key.get(key) is book:
+                    del self._books_by_key[key]
+                    self.search_index.remove(key)
+                    self.fuzzy_books.remove(key)
+            self._subject_index = None
+            self.stats.books_removed(len(removed))
+            self.persist(deleted_books=removed)
+
+    @_mutation
+    def record_borrow(self, user: dict, book: dict, loan_days: int = 14) -> dict | None:
+        """Open a loan for ``user`` if ``book`` still has a free copy.
+
+        Returns the new transaction, or ``None`` when another session took the
+        last copy or the user already holds this book.
+        """
+        with self.lock:
+            # The data may have been reloaded since the caller looked these up.
+            book = self.get_book(book['id'], book.get('programme'))
+            if book is None:
+                return None
+            user = self.get_user(user['id']) or user
+            self._expire_holds()
+            if self.active_loan(user['id'], book):
+                return None
+            reservation = self._active_reservations.get((user['id'], book_key(book)))
+            holding = reservation is not None and reservation['status'] == 'held'
+            if not holding and book['available'] <= 0:
+                return None
+
+            now = datetime.now()
+            transaction = self.transactions.add({
+                'id': len(self.transactions) + 1,
+                'user_id': user['id'],
+                'user_name': user['name'],
+                'book_id': book['id'],
+                'book_title': book['title'],
+                'book_programme': book.get('programme'),
+                'borrow_date': now.strftime('%Y-%m-%d'),
+                'due_date': (now + timedelta(days=loan_days)).strftime('%Y-%m-%d'),
+                'return_date': None,
+                'status': 'borrowed',
+                'fine': 0
+            })
+            self._index_transaction(transaction)
+            self.stats.loan_opened()
+            if not holding:
+                # A held copy was already taken off the shelf on return.
+                book['available'] -= 1
+            if reservation is not None:
+                self._close_reservation(reservation, 'fulfilled')
+            self.persist(
+                transactions=[transaction],
+                books=[book],
+                reservations=[reservation] if reservation is not None else [],
+            )
+            return transaction
 
-    def get_active_reservation(self, user_id: str, book_id: str) -> dict | None:
-        for record in self.reservations:
-            if (
-                record.get('user_id') == user_id
-                and record.get('book_id') == book_id
-                and record.get('status', 'waiting') == 'waiting'
-            ):
-                return record
+    @_mutation
+    def record_return(self, trans: dict) -> bool:
+        """Close a loan, charge ₹10 per late day and free the copy.
+
+        Returns True when the book came back on time.
+        """
+        with self.lock:
+            trans = self.get_transaction(trans['id']) or trans
+            if trans['status'] != 'borrowed':
+                return not trans.get('fine')
+
+            self._set_transaction_status(trans, 'returned')
+            trans['return_date'] = datetime.now().strftime('%Y-%m-%d')
+            self.stats.loan_closed()
+
+            # Calculate fine
+            days_late = days_overdue(trans['due_date'])
+            if days_late > 0:
+                fine = fine_for(trans['due_date'])
+                self.stats.fine_changed(trans.get('fine'), fine)
+                trans['fine'] = fine
+
+            # Hold the copy for the next reader, or put it back on the shelf
+            book = self.get_book(trans['book_id'], trans.get('book_programme'))
+            reservations = self._release_copy(book) if book else []
+
+            self.persist(transactions=[trans], books=[book] if book else [], reservations=reservations)
+            return days_late <= 0
+
+    def overdue_loans(self, today=None) -> list[dict]:
+        """Active loans past their due date, most overdue first."""
+        return self._due_index.overdue(today)
+
+    def loans_due_within(self, days: int, today=None) -> list[dict]:
+        """Active loans falling due from today through the next ``days`` days."""
+        return self._due_index.due_within(days, today)
+
+    @_mutation
+    def accrue_fines(self, today=None) -> list[dict]:
+        """Bring the running fine on every overdue loan up to date."""
+        with self.lock:
+            changed = []
+            for transaction in self._due_index.overdue(today):
+                fine = fine_for(transaction['due_date'], today)
+                if transaction.get('fine') != fine:
+                    self.stats.fine_changed(transaction.get('fine'), fine)
+                    transaction['fine'] = fine
+                    changed.append(transaction)
+            if changed:
+                self.persist(transactions=changed)
+            return changed
+
+    def get_active_reservation(self, user_id: str, book: dict) -> dict | None:
+        return self._active_reservations.get((user_id, book_key(book)))
+
+    def held_reservation(self, user_id: str, book: dict) -> dict | None:
+        """Return the user's hold on a returned copy of this book, if any."""
+        record = self._active_reservations.get((user_id, book_key(book)))
+        return record if record is not None and record['status'] == 'held' else None
+
+    def reservation_queue(self, book: dict) -> list[dict]:
+        """Return the waiting reservations for a book, first in line first."""
+        return [self._reservations_by_seq[seq] for seq in self._reservation_queues.get(book_key(book), [])]
+
+    def queue_position(self, record: dict) -> int | None:
+        """Return the 1-based place of a waiting reservation in its book's queue."""
+        if record.get('status', 'waiting') != 'waiting':
+            return None
+        queue = self._reservation_queues.get(loaned_book_key(record), [])
+        index = bisect.bisect_left(queue, record['seq'])
+        if index < len(queue) and queue[index] == record['seq']:
+            return index + 1
         return None
 
+    def _release_copy(self, book: dict) -> list[dict]:
+        """Hold a freed copy of ``book`` for the head of its queue.
+
+        The copy only goes back on the shelf when nobody is waiting. Returns
+        the reservations that changed.
+        """
+        queue = self._reservation_queues.get(book_key(book))
+        if not queue:
+            book['available'] += 1
+            return []
+        record = self._reservations_by_seq[queue.pop(0)]
+        if not queue:
+            del self._reservation_queues[book_key(book)]
+        now = datetime.now()
+        record['status'] = 'held'
+        record['held_at'] = now.strftime('%Y-%m-%d %H:%M')
+        record['hold_expires_at'] = (now + timedelta(days=self.RESERVATION_HOLD_DAYS)).strftime('%Y-%m-%d %H:%M')
+        heapq.heappush(self._hold_expiry, (record['hold_expires_at'], record['seq']))
+        self._queue_hold_notice(record, book)
+        return [record]
+
+    def _queue_hold_notice(self, record: dict, book: dict) -> None:
+        email = record.get('user_email')
+        if not isinstance(email, str) or '@' not in email:
+            return
+        if self.outbox.configure():
+            return
+        message = build_hold_message(self.outbox.sender, email, record.get('user_name') or 'Reader', book, record)
+        self._after_save(lambda: self.outbox.enqueue(message, kind='hold', reference=record['id']))
+
+    def _after_save(self, action: Callable[[], object]) -> None:
+        """Run ``action`` once the current mutation's save has succeeded."""
+        pending = getattr(self._mutating, 'after_save', None)
+        if pending is None:
+            action()
+        else:
+            pending.append(action)
+
+    def expire_holds(self) -> list[dict]:
+        """Pass copies whose hold ran out to the next reader or back to the shelf.
+
+        Runs on every books-page rerun, so the earliest expiry is checked
+        without taking any lock; the locks are only taken once one is due.
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M')
+        try:
+            if self._hold_expiry[0][0] > now:
+                return []
+        except IndexError:
+            return []
+        return self._expire_due_holds(now)
+
+    @_mutation
+    def _expire_due_holds(self, now: str) -> list[dict]:
+        with self.lock:
+            return self._expire_holds(now)
+
+    def _expire_holds(self, now: str | None = None) -> list[dict]:
+        now = now or datetime.now().strftime('%Y-%m-%d %H:%M')
+        changed: list[dict] = []
+        books: list[dict] = []
+        while self._hold_expiry and self._hold_expiry[0][0] <= now:
+            expires_at, seq = heapq.heappop(self._hold_expiry)
+            record = self._reservations_by_seq.get(seq)
+            if record is None or record['status'] != 'held' or record['hold_expires_at'] != expires_at:
+                continue
+            self._close_reservation(record, 'expired')
+            changed.append(record)
+            book = self.get_book(record['book_id'], record.get('programme'))
+            if book:
+                changed.extend(self._release_copy(book))
+                books.append(book)
+        if changed:
+            self.persist(reservations=changed, books=books)
+        return changed
+
+    @_mutation
     def create_reservation(self, user: dict, book: dict) -> dict:
-        sequence = len(self.reservations) + 1
+        with self.lock:
+            return self._create_reservation(user, book)
+
+    def _create_reservation(self, user: dict, book: dict) -> dict:
+        existing = self._active_reservations.get((user.get('id'), book_key(book)))
+        if existing is not None:
+            return existing
+        sequence = self._next_reservation_seq
+        self._next_reservation_seq += 1
         reservation_id = f"RSV{datetime.now().strftime('%Y%m%d%H%M%S')}{sequence:03d}"
         reserved_at = datetime.now().strftime('%Y-%m-%d %H:%M')
-        record = {
+        record = Reservation({
             'id': reservation_id,
+            'seq': sequence,
             'book_id': book['id'],
             'book_title': book.get('title'),
             'programme': book.get('programme'),
@@ -2353,9 +2949,10 @@ class BookFlowApp:
             'user_email': user.get('email'),
             'status': 'waiting',
             'reserved_at': reserved_at,
-        }
+        })
         self.reservations.append(record)
-        self.save_data()
+        self._index_reservation(record)
+        self.persist(reservations=[record])
         return record
 
     def get_default_users(self):
@@ -2381,25 +2978,16 @@ class BookFlowApp:
         admin_contact = os.getenv('BOOKFLOW_ADMIN_CONTACT', 'Not provided')
         admin_email = os.getenv('BOOKFLOW_ADMIN_EMAIL', 'Not provided')
 
-        admin_hash, admin_salt = hash_password(admin_password)
         defaults['admin'] = [{
             'id': os.getenv('BOOKFLOW_ADMIN_ID', 'ADMIN001'),
             'username': admin_username,
-            'password_hash': admin_hash,
-            'password_salt': admin_salt,
+            'password': admin_password,
             'name': os.getenv('BOOKFLOW_ADMIN_NAME', 'Administrator'),
             'contact': admin_contact,
             'email': admin_email
         }]
 
-        for role_users in defaults.values():
-            for user in role_users:
-                if 'password' in user:
-                    password_hash, password_salt = hash_password(user['password'])
-                    user['password_hash'] = password_hash
-                    user['password_salt'] = password_salt
-                    user.pop('password', None)
-
+        ensure_password_fields_many(user for role_users in defaults.values() for user in role_users)
         return defaults
     
     def get_default_books(self):
@@ -2448,8 +3036,28 @@ class BookFlowApp:
                 user['programme'] = default_programme
                 updated = True
 
-        if updated:
+        return updated
+
+    @_mutation
+    def restore_backup(self, path: str) -> None:
+        """Replace all stored data with a JSON backup and reload it."""
+        with self.lock:
+            self.storage.import_json(path)
+            self._load_data()
+
+    @_mutation
+    def reseed_programme(self, programme: str) -> list[dict]:
+        """Re-add any missing default books and return ``programme``'s books."""
+        self.seed_program_books()
+        self.normalize_book_metadata()
+        # Same shape as after a load: shared-template records, not plain dicts.
+        self.compact_program_books()
+        self.wrap_records()
+        self.rebuild_indexes()
+        books = self.books.get('program_books', {}).get(programme, [])
+        if books:
             self.save_data()
+        return books
 
     def seed_program_books(self):
         program_books = self.books.setdefault('program_books', {})
@@ -2461,7 +3069,7 @@ class BookFlowApp:
             slug = _slugify_program(programme)
             default_map = {book['id'].split('_')[0]: book for book in default_books}
             if not existing:
-                program_books[programme] = [dict(book) for book in default_books]
+                program_books[programme] = default_books
                 seeded = True
             else:
                 existing_map = {book['id'].split('_')[0]: book for book in existing}
@@ -2480,7 +3088,7 @@ class BookFlowApp:
                         needs_refresh = True
                         break
                 if needs_refresh:
-                    program_books[programme] = [dict(book) for book in default_books]
+                    program_books[programme] = default_books
                     seeded = True
                 else:
                     for base_id, template in default_map.items():
@@ -2494,9 +3102,7 @@ class BookFlowApp:
                                 existing_book['pdf_url'] = template['pdf_url']
                                 seeded = True
                         else:
-                            new_entry = dict(template)
-                            new_entry['available'] = new_entry.get('copies', 1)
-                            existing.append(new_entry)
+                            existing.append(template)
                             seeded = True
 
         # ensure general library defaults exist
@@ -2524,8 +3130,7 @@ class BookFlowApp:
                     book['copies'] = template['copies']
                     book['available'] = min(book.get('available', template['copies']), template['copies'])
 
-        if seeded:
-            self.save_data()
+        return seeded
 
     def seed_collection_catalog(self):
         catalog = self.books.setdefault('collection_catalog', {})
@@ -2582,30 +3187,30 @@ class BookFlowApp:
                 item['catalog_type'] = 'collection'
                 item['collection'] = name
 
-        if updated:
-            self.save_data()
+        return updated
+
+    @staticmethod
+    def normalize_program_book(book: dict, programme: str, category: str | None = None) -> None:
+        book['catalog_type'] = 'program'
+        book['programme'] = sys.intern(programme)
+        book['program_category'] = sys.intern(category or programme_category(programme) or 'General')
+        copies = max(int(book.get('copies', 1)), 1)
+        available = book.get('available', copies)
+        book['copies'] = copies
+        book['available'] = min(max(int(available), 0), copies)
+        pdf_url = book.get('pdf_url')
+        if isinstance(pdf_url, str):
+            book['pdf_url'] = pdf_url.strip()
+        else:
+            book.pop('pdf_url', None)
+        _ensure_subject_tag(book)
 
     def normalize_book_metadata(self):
         program_books = self.books.get('program_books', {})
         for programme, books in program_books.items():
             category = programme_category(programme) or 'General'
             for book in books:
-                book['catalog_type'] = 'program'
-                book['programme'] = programme
-                book['program_category'] = category
-                copies = max(int(book.get('copies', 1)), 1)
-                available = book.get('available', copies)
-                book['copies'] = copies
-                book['available'] = min(max(int(available), 0), copies)
-                pdf_url = book.get('pdf_url')
-                if isinstance(pdf_url, str):
-                    book['pdf_url'] = pdf_url.strip()
-                else:
-                    book.pop('pdf_url', None)
-                if book.get('copies') and book.get('copies', 0) < book.get('copies', 1):
-                    book['copies'] = book.get('copies', 1)
-                    book['available'] = min(book.get('available', book.get('copies', 1)), book.get('copies', 1))
-                _ensure_subject_tag(book)
+                self.normalize_program_book(book, programme, category)
 
         catalog = self.books.setdefault('collection_catalog', {})
         for name, items in catalog.items():
@@ -2644,6 +3249,40 @@ class BookFlowApp:
             book['available'] = min(max(int(available), 0), copies)
             _ensure_subject_tag(book)
 
+    def compact_program_books(self) -> None:
+        """Replace stored copies of default books with shared-template records."""
+        templates = _book_template_records()
+        for programme, books in self.books.get('program_books', {}).items():
+            category = programme_category(programme)
+            if category not in templates:
+                continue
+            record = _programme_record(programme, category)
+            by_base_id: dict[str, BookTemplate] = {}
+            for template in templates[category]:
+                by_base_id.setdefault(template.base_id, template)
+            for index, book in enumerate(books):
+                if isinstance(book, ProgramBook):
+                    continue
+                base_id, _, slug = str(book.get('id', '')).rpartition('_')
+                template = by_base_id.get(base_id)
+                if template is not None and slug == record.slug:
+                    books[index] = ProgramBook.from_dict(template, record, book)
+
+    def wrap_records(self) -> None:
+        """Load every stored record into its slotted record type."""
+        for users in self.users.values():
+            if isinstance(users, list):
+                users[:] = [User.from_dict(user) for user in users]
+        for books in self.books.get('program_books', {}).values():
+            books[:] = [book if isinstance(book, ProgramBook) else Book.from_dict(book) for book in books]
+        teacher_books = self.books.get('teacher_books', [])
+        teacher_books[:] = [Book.from_dict(book) for book in teacher_books]
+        for items in self.books.get('collection_catalog', {}).values():
+            items[:] = [Book.from_dict(item) for item in items]
+        if not isinstance(self.transactions, TransactionLedger):
+            self.transactions = TransactionLedger(self.transactions)
+        self.reservations[:] = [Reservation.from_dict(record) for record in self.reservations]
+
     def get_program_books(self, programme: str) -> list[dict]:
         return self.books.get('program_books', {}).get(programme, [])
 
@@ -2654,23 +3293,54 @@ class BookFlowApp:
 
     def verify_login(self, username, password, role):
         """Verify user credentials"""
-        role_key = 'students' if role == 'student' else 'teachers' if role == 'teacher' else 'admin'
-        users = self.users.get(role_key, [])
+        role_key = self.role_key(role)
+        user = self.find_user(role_key, username)
+        if user is None:
+            # Hash anyway so unknown usernames are not faster to reject.
+            self.credentials.verify(password, dummy_password_hash())
+            return None
+        if not self.credentials.verify(password, user.get('password_hash'), user.get('password_salt')):
+            return None
+        if needs_rehash(user.get('password_hash')):
+            self._schedule_rehash(role_key, user, password)
+        return user
+
+    def _schedule_rehash(self, role_key: str, user: dict, password: str) -> None:
+        """Upgrade ``user`` to the configured hash parameters off the login path."""
+        with self.lock:
+            if user['id'] in self._rehashing:
+                return
+            self._rehashing.add(user['id'])
+        stored_hash = user.get('password_hash')
+
+        def upgrade():
+            try:
+                new_hash = self.credentials.hash(password)
+            except CredentialServiceBusy:
+                return  # Retried on the next successful login.
+            finally:
+                with self.lock:
+                    self._rehashing.discard(user['id'])
+            with self.lock:
+                current = self.get_user(user['id'])
+                # Skip if the password changed while we were hashing.
+                if current is None or current.get('password_hash') != stored_hash:
+                    return
+                self.update_user(role_key, user['id'], {'password_hash': new_hash})
+
+        threading.Thread(target=upgrade, name='bookflow-rehash', daemon=True).start()
+
+
+@st.cache_resource
+def get_shared_app() -> BookFlowApp:
+    """Return the BookFlowApp shared by every session in this server process."""
+    return BookFlowApp()
 
-        
-        for user in users:
-            if user['username'] == username and verify_password(password, user.get('password_hash'), user.get('password_salt')):
-                return user
-        return None
 
 # Initialize app
-if 'app' not in st.session_state:
-    st.session_state.app = BookFlowApp()
-elif not (
-    hasattr(st.session_state.app, 'get_active_reservation')
-    and hasattr(st.session_state.app, 'create_reservation')
-):
-    st.session_state.app = BookFlowApp()
+st.session_state.app = get_shared_app()
+# Pick up changes other worker processes saved since the last rerun.
+st.session_state.app.refresh_if_changed()
 
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -2725,7 +3395,11 @@ def login_page():
         with col_a:
             if st.button("🚀 Login", use_container_width=True, type="primary"):
                 if username and password:
-                    user = st.session_state.app.verify_login(username, password, role.lower())
+                    try:
+                        user = st.session_state.app.verify_login(username, password, role.lower())
+                    except CredentialServiceBusy as exc:
+                        st.warning(f"⏳ {exc} Please try again in a moment.")
+                        st.stop()
                     if user:
                         st.session_state.logged_in = True
                         st.session_state.user = user
@@ -2809,22 +3483,16 @@ def register_page():
                         st.error("❌ ID already exists!")
                     else:
                         # Create new user with hashed password
-                        password_hash, password_salt = hash_password(password)
                         new_user = {
                             'id': user_id,
                             'username': username,
-                            'password_hash': password_hash,
-                            'password_salt': password_salt,
+                            'password_hash': hash_password(password),
                             'name': name,
                             'contact': contact if contact else 'Not provided',
                             'email': email if email else 'Not provided'
                         }
 
-                        if role_key not in st.session_state.app.users:
-                            st.session_state.app.users[role_key] = []
-                        
-                        st.session_state.app.users[role_key].append(new_user)
-                        st.session_state.app.save_data()
+                        st.session_state.app.add_user(role_key, new_user)
                         
                         st.success(f"✅ Account created successfully! You can now login with username: {username}")
                         _celebration_gif()
@@ -2836,6 +3504,7 @@ def register_page():
 
 def show_books_page():
     """Display books catalog with programme and special collections."""
+    st.session_state.app.expire_holds()
 
     def render_flash_banner():
         reserve_info = st.session_state.pop('reserve_confirmation', None)
@@ -2850,6 +3519,8 @@ def show_books_page():
 
             if email_status == 'sent' and email_address:
                 st.success(f"{base_message}. Confirmation email sent to **{email_address}**.")
+            elif email_status == 'queued' and email_address:
+                st.success(f"{base_message}. Confirmation email queued for **{email_address}**.")
             elif email_status == 'failed':
                 error_detail = reserve_info.get('email_error')
                 detail_suffix = f" Reason: {error_detail}" if error_detail else ''
@@ -2877,44 +3548,62 @@ def show_books_page():
             unsafe_allow_html=True,
         )
 
-    def render_book_cards(book_list: list[dict]):
+    def render_book_cards(book_list: list[dict], view: str = ''):
         if not book_list:
             st.info("📭 No titles available in this view yet!")
             return
 
         search = st.text_input(
             "🔍 Search books",
-            placeholder="Search by title or author...",
+            placeholder="Search by title, author, subject or ID...",
             label_visibility="collapsed",
         )
 
         if search:
-            term = search.lower()
-            book_list = [
-                b
-                for b in book_list
-                if term in b.get('title', '').lower() or term in b.get('author', '').lower()
-            ]
+            book_list, similar = st.session_state.app.search_books(search, book_list)
+            if similar and book_list:
+                st.caption(f"No exact matches for \"{search}\" - showing similar titles and authors.")
 
         subject_filter = st.session_state.get('selected_subject')
         if subject_filter and subject_filter != 'All Subjects':
-            book_list = [
-                b for b in book_list if (_ensure_subject_tag(b) or '').lower() == subject_filter.lower()
-            ]
+            subject_keys = st.session_state.app.subject_book_keys(subject_filter)
+            book_list = [b for b in book_list if book_key(b) in subject_keys]
 
         if not book_list:
             st.info("📭 No books found matching your search!")
             return
 
-        st.markdown(
-            f"<p style='color: #6C0345; font-weight: 600; margin: 1rem 0;'>Found {len(book_list)} item(s)</p>",
-            unsafe_allow_html=True,
-        )
+        # Only the current page of cards is rendered; the rest stay as references.
+        total = len(book_list)
+        page_sizes = sorted(set(PAGE_SIZE_OPTIONS) | {default_page_size()})
+        if st.session_state.get('book_page_size') not in page_sizes:
+            st.session_state.book_page_size = default_page_size()
+        page_size = st.session_state.book_page_size
+        page_count = max(1, -(-total // page_size))
+
+        # Start from the first page whenever the view, search or filter changes.
+        view_state = (view, search, subject_filter, total, page_size)
+        if st.session_state.get('book_page_view') != view_state:
+            st.session_state.book_page_view = view_state
+            st.session_state.book_page = 0
+        page = min(max(st.session_state.get('book_page', 0), 0), page_count - 1)
+        start = page * page_size
+        visible_books = book_list[start:start + page_size]
+
+        col_count, col_size = st.columns([4, 1])
+        with col_count:
+            st.markdown(
+                f"<p style='color: #6C0345; font-weight: 600; margin: 1rem 0;'>Found {total} item(s)"
+                f" - showing {start + 1}-{start + len(visible_books)}</p>",
+                unsafe_allow_html=True,
+            )
+        with col_size:
+            st.selectbox("Per page", page_sizes, key="book_page_size")
 
-        for book in book_list:
+        for book in visible_books:
             is_borrowable = bool(book.get('borrowable', True))
-            available = int(book.get('available', 0))
-            copies = int(book.get('copies', 0))
+            available = book.get('available', 0)
+            copies = book.get('copies', 0)
             status_color = "#28a745" if available > 0 else "#dc3545"
             status_text = "Available" if available > 0 else "Not Available"
             status_icon = "✅" if available > 0 else "❌"
@@ -3017,6 +3706,27 @@ def show_books_page():
 
             st.markdown("<br>", unsafe_allow_html=True)
 
+        if page_count > 1:
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if st.button("◀ Previous", key=f"book_page_prev_{view}", disabled=page == 0, use_container_width=True):
+                    st.session_state.book_page = page - 1
+                    st.rerun()
+            with col_page:
+                st.markdown(
+                    f"<p style='text-align: center; margin: 0.5rem 0;'>Page {page + 1} of {page_count}</p>",
+                    unsafe_allow_html=True,
+                )
+            with col_next:
+                if st.button(
+                    "Next ▶",
+                    key=f"book_page_next_{view}",
+                    disabled=page >= page_count - 1,
+                    use_container_width=True,
+                ):
+                    st.session_state.book_page = page + 1
+                    st.rerun()
+
     def render_programme_view():
         program_books = st.session_state.app.books.get('program_books', {})
         
@@ -3067,8 +3777,9 @@ def show_books_page():
                 if programmes and st.button("Set Programme", type="primary"):
                     st.session_state.selected_program = selected_programme
                     if selected_programme:
-                        st.session_state.user['programme'] = selected_programme
-                        st.session_state.app.save_data()
+                        st.session_state.user = st.session_state.app.update_user(
+                            'students', st.session_state.user['id'], {'programme': selected_programme}
+                        ) or st.session_state.user
                     st.rerun()
 
             active_program = st.session_state.selected_program
@@ -3084,11 +3795,7 @@ def show_books_page():
         subject_filter = st.session_state.get('selected_subject')
         if subject_filter and subject_filter != 'All Subjects':
             # If subject filter is active, collect books from ALL programmes with that subject
-            book_list = []
-            for prog_books in st.session_state.app.books.get('program_books', {}).values():
-                for book in prog_books:
-                    if (_ensure_subject_tag(book) or '').lower() == subject_filter.lower():
-                        book_list.append(book)
+            book_list = st.session_state.app.books_with_subject(subject_filter, 'program')
         else:
             # Otherwise, show books from the active programme
             book_list = programme_books(active_program) if active_program else []
@@ -3167,7 +3874,7 @@ def show_books_page():
 
             st.markdown("<hr style='margin: 0.5rem 0 1rem 0; border: 0; border-top: 1px solid rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
 
-        render_book_cards(book_list)
+        render_book_cards(book_list, view=f"programme:{active_program}")
 
     def render_collection_view():
         catalog = collection_catalog()
@@ -3190,22 +3897,23 @@ def show_books_page():
         subject_filter = st.session_state.get('selected_subject')
         if subject_filter and subject_filter != 'All Subjects':
             items = [
-                item for item in items 
-                if (_ensure_subject_tag(item) or '').lower() == subject_filter.lower()
+                item for item in st.session_state.app.books_with_subject(subject_filter, 'collection')
+                if item.get('collection') == active_collection
             ]
         
         render_header(
             f"{active_collection} Collection",
             "Special resources, magazines, and reference material",
         )
-        render_book_cards(items)
+        render_book_cards(items, view=f"collection:{active_collection}")
 
     render_flash_banner()
 
     if 'books_nav' not in st.session_state:
         st.session_state.books_nav = 'Programmes'
 
-    available_subjects = ['All Subjects'] + all_subjects()
+    subject_counts = st.session_state.app.subject_facets()
+    available_subjects = ['All Subjects'] + list(subject_counts)
     current_subject = st.session_state.get('selected_subject', 'All Subjects')
     if current_subject not in available_subjects:
         current_subject = 'All Subjects'
@@ -3224,6 +3932,7 @@ def show_books_page():
             "",
             available_subjects,
             index=available_subjects.index(current_subject),
+            format_func=lambda s: f"{s} ({subject_counts[s]})" if s in subject_counts else s,
             label_visibility="collapsed",
         )
 
@@ -3250,14 +3959,11 @@ def show_borrow_modal(book):
     """, unsafe_allow_html=True)
     
     # Check if user already has this book
-    already_borrowed = [t for t in st.session_state.app.transactions 
-                       if t['user_id'] == st.session_state.user['id'] 
-                       and t['book_id'] == book['id'] 
-                       and t['status'] == 'borrowed']
+    trans = st.session_state.app.active_loan(st.session_state.user['id'], book)
+    held = st.session_state.app.held_reservation(st.session_state.user['id'], book)
     
-    if already_borrowed:
+    if trans:
         # Show error - already borrowed
-        trans = already_borrowed[0]
         st.error(f"""
         ❌ **You Already Have This Book!**
         
@@ -3274,8 +3980,11 @@ def show_borrow_modal(book):
             st.rerun()
     
     # Availability status
-    elif book['available'] > 0:
-        st.success(f"✅ **Available:** {book['available']} of {book['copies']} copies")
+    elif book['available'] > 0 or held:
+        if held:
+            st.success(f"📌 **A copy is being held for you** until {held['hold_expires_at']}")
+        else:
+            st.success(f"✅ **Available:** {book['available']} of {book['copies']} copies")
         
         # Borrow details
         st.info(f"""
@@ -3301,11 +4010,13 @@ def show_borrow_modal(book):
         st.error("❌ **Not Available** - All copies are currently borrowed")
 
         current_user = st.session_state.user
-        existing_reservation = st.session_state.app.get_active_reservation(current_user['id'], book['id'])
+        existing_reservation = st.session_state.app.get_active_reservation(current_user['id'], book)
 
         if existing_reservation:
+            position = st.session_state.app.queue_position(existing_reservation)
+            place = f" You are **#{position}** in the queue." if position else ""
             st.info(
-                f"📌 You already reserved this title on **{existing_reservation.get('reserved_at')}**. "
+                f"📌 You already reserved this title on **{existing_reservation.get('reserved_at')}**.{place} "
                 "We'll notify you when it becomes available."
             )
             st.caption(f"Reservation ID: {existing_reservation.get('id')}")
@@ -3346,12 +4057,9 @@ def show_borrow_modal(book):
 
                 reservation = st.session_state.app.create_reservation(current_user, book)
 
-                email_status = 'sent'
-                email_error = None
-                sent, error = send_reservation_email(clean_email, current_user['name'], book, reservation)
-                if not sent:
-                    email_status = 'failed'
-                    email_error = error
+                email_status, email_error = queue_reservation_email(
+                    clean_email, current_user['name'], book, reservation
+                )
 
                 st.session_state['reserve_confirmation'] = {
                     'book_title': reservation.get('book_title'),
@@ -3380,8 +4088,7 @@ def show_who_has_modal(book):
     """, unsafe_allow_html=True)
     
     # Get borrowers
-    borrowers = [t for t in st.session_state.app.transactions 
-                 if t['book_id'] == book['id'] and t['status'] == 'borrowed']
+    borrowers = st.session_state.app.active_loans(book)
     
     if borrowers:
         st.markdown(f"**📊 Currently Borrowed:** {len(borrowers)} of {book['copies']} copies")
@@ -3389,12 +4096,7 @@ def show_who_has_modal(book):
         
         for trans in borrowers:
             # Find user details
-            user_details = None
-            for role in ['students', 'teachers']:
-                user_details = next((u for u in st.session_state.app.users.get(role, []) 
-                                   if u['id'] == trans['user_id']), None)
-                if user_details:
-                    break
+            user_details = st.session_state.app.get_user(trans['user_id'])
             
             if user_details:
                 st.markdown(f"""
@@ -3472,19 +4174,16 @@ def show_details_modal(book):
 
 def borrow_book(book):
     """Borrow a book"""
-    if book['available'] <= 0:
+    held = st.session_state.app.held_reservation(st.session_state.user['id'], book)
+    if book['available'] <= 0 and not held:
         st.error(f"❌ '{book['title']}' is not available!")
         return False
     
     # Check if user already has this book
-    active_borrows = [t for t in st.session_state.app.transactions 
-                     if t['user_id'] == st.session_state.user['id'] 
-                     and t['book_id'] == book['id'] 
-                     and t['status'] == 'borrowed']
+    trans = st.session_state.app.active_loan(st.session_state.user['id'], book)
     
-    if active_borrows:
+    if trans:
         # Show detailed error with due date
-        trans = active_borrows[0]
         st.error(f"""
         ❌ **Cannot Borrow - Already Borrowed!**
         
@@ -3498,25 +4197,12 @@ def borrow_book(book):
         return False
     
     # Create transaction
-    due_date = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
-    transaction = {
-        'id': len(st.session_state.app.transactions) + 1,
-        'user_id': st.session_state.user['id'],
-        'user_name': st.session_state.user['name'],
-        'book_id': book['id'],
-        'book_title': book['title'],
-        'book_programme': book.get('programme'),
-        'borrow_date': datetime.now().strftime('%Y-%m-%d'),
-        'due_date': due_date,
-        'return_date': None,
-        'status': 'borrowed',
-        'fine': 0
-    }
-    
-    st.session_state.app.transactions.append(transaction)
-    book['available'] -= 1
-    st.session_state.app.save_data()
-    st.session_state['borrow_due_date'] = due_date
+    transaction = st.session_state.app.record_borrow(st.session_state.user, book)
+    if transaction is None:
+        st.error(f"❌ '{book['title']}' was just borrowed by someone else!")
+        return False
+
+    st.session_state['borrow_due_date'] = transaction['due_date']
     
     return True
 
@@ -3594,8 +4280,7 @@ def my_transactions_page():
     
     st.markdown("## 📊 My Transactions")
     
-    user_trans = [t for t in st.session_state.app.transactions 
-                  if t['user_id'] == st.session_state.user['id']]
+    user_trans = st.session_state.app.user_transactions(st.session_state.user['id'])
     
     if not user_trans:
         st.info("📭 No transactions yet!")
@@ -3653,29 +4338,7 @@ def my_transactions_page():
 
 def return_book(trans):
     """Return a book"""
-    trans['status'] = 'returned'
-    trans['return_date'] = datetime.now().strftime('%Y-%m-%d')
-    
-    # Calculate fine
-    due_date = datetime.strptime(trans['due_date'], '%Y-%m-%d')
-    return_date = datetime.now()
-    days_late = (return_date - due_date).days
-    
-    on_time = days_late <= 0
-    
-    if days_late > 0:
-        trans['fine'] = days_late * 10
-    
-    # Update book availability
-    programme = trans.get('book_programme')
-    if programme:
-        book = next((b for b in programme_books(programme) if b['id'] == trans['book_id']), None)
-    else:
-        book = next((b for b in st.session_state.app.books['teacher_books'] if b['id'] == trans['book_id']), None)
-    if book:
-        book['available'] += 1
-    
-    st.session_state.app.save_data()
+    on_time = st.session_state.app.record_return(trans)
     
     # Trigger celebration modal
     st.session_state['show_return_success'] = True
@@ -0,0 +1,269 @@
+"""Full-text search over the BookFlow catalogue."""
+
+from __future__ import annotations
+
+import bisect
+import math
+import re
+import time
+from typing import Callable, Hashable, Iterable
+
+# Field weights used when ranking matches; titles count most.
+SEARCH_FIELDS: dict[str, float] = {
+    'title': 3.0,
+    'author': 2.0,
+    'id': 2.0,
+    'isbn': 2.0,
+    'subject': 1.5,
+    'description': 1.0,
+}
+
+# A prefix hit scores a little lower than the whole word.
+_PREFIX_FACTOR = 0.8
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+
+# Fields the fuzzy index compares against for books and for users.
+FUZZY_BOOK_FIELDS = ('title', 'author', 'subject')
+FUZZY_USER_FIELDS = ('name', 'id', 'username')
+
+# Fuzzy searches stop refining once this many seconds have passed.
+FUZZY_TIME_BUDGET = 0.05
+
+
+def tokenize(text) -> list[str]:
+    """Split text into lowercase alphanumeric tokens."""
+    if not isinstance(text, str):
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+class CatalogSearchIndex:
+    """Inverted index from tokens to the books that contain them.
+
+    Books are keyed by id, or by ``key(book)`` when ids alone are not unique.
+    ``add``, ``update`` and ``remove`` keep the index current as the catalogue
+    is edited, so searches never rescan every book.
+    """
+
+    def __init__(self, books: Iterable[dict] = (), key: Callable[[dict], Hashable] | None = None):
+        self._key = key or (lambda book: book.get('id'))
+        self._postings: dict[str, dict] = {}
+        self._doc_terms: dict = {}
+        self._terms: list[str] = []
+        for book in books:
+            self.add(book)
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, book_id) -> bool:
+        return book_id in self._doc_terms
+
+    @staticmethod
+    def _book_terms(book: dict) -> dict[str, float]:
+        terms: dict[str, float] = {}
+        for field, weight in SEARCH_FIELDS.items():
+            value = book.get(field)
+            for token in tokenize(value):
+                terms[token] = terms.get(token, 0.0) + weight
+            if field == 'id' and isinstance(value, str) and value:
+                # Keep the whole id searchable as well as its parts.
+                whole = value.lower()
+                terms[whole] = terms.get(whole, 0.0) + weight
+        return terms
+
+    def add(self, book: dict) -> None:
+        book_id = self._key(book)
+        if not book_id:
+            return
+        if book_id in self._doc_terms:
+            self.remove(book_id)
+        terms = self._book_terms(book)
+        self._doc_terms[book_id] = terms
+        for term, weight in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[book_id] = weight
+
+    def update(self, book: dict) -> None:
+        self.add(book)
+
+    def remove(self, book_id) -> None:
+        terms = self._doc_terms.pop(book_id, None)
+        if not terms:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[term]
+                idx = bisect.bisect_left(self._terms, term)
+                if idx < len(self._terms) and self._terms[idx] == term:
+                    del self._terms[idx]
+
+    def _expand(self, token: str) -> list[str]:
+        start = bisect.bisect_left(self._terms, token)
+        end = bisect.bisect_left(self._terms, token + '\uffff')
+        return self._terms[start:end]
+
+    def search(self, query: str, limit: int | None = None) -> list:
+        """Return keys of books matching every query term, best first.
+
+        Each term matches whole tokens or token prefixes; scores add up the
+        field weights scaled by how rare the matched token is.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        total_docs = max(len(self._doc_terms), 1)
+        scores: dict | None = None
+        for token in tokens:
+            term_scores: dict = {}
+            for term in self._expand(token):
+                postings = self._postings[term]
+                idf = math.log(1 + total_docs / len(postings))
+                factor = 1.0 if term == token else _PREFIX_FACTOR
+                for book_id, weight in postings.items():
+                    score = weight * idf * factor
+                    if score > term_scores.get(book_id, 0.0):
+                        term_scores[book_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    book_id: score + term_scores[book_id]
+                    for book_id, score in scores.items()
+                    if book_id in term_scores
+                }
+            if not scores:
+                return []
+
+        ranked = sorted(scores, key=lambda book_id: (-scores[book_id], book_id))
+        return ranked[:limit] if limit is not None else ranked
+
+
+def trigrams(word: str) -> set[str]:
+    """Return the padded character trigrams of ``word``."""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Typo-tolerant lookup of records by the words in their fields.
+
+    Every distinct word is split into character trigrams, and query words are
+    matched to indexed words by the Dice similarity of their trigram sets, so
+    "sharama" still finds "sharma". Records are keyed by any hashable id: the
+    ``key`` field, or what ``key(record)`` returns when it is a function.
+    """
+
+    def __init__(self, fields: Iterable[str], records: Iterable[dict] = (), key: str | Callable = 'id'):
+        self.fields = tuple(fields)
+        self.key = key
+        self._word_records: dict[str, set] = {}
+        self._record_words: dict = {}
+        self._gram_words: dict[str, set[str]] = {}
+        self._word_grams: dict[str, int] = {}
+        for record in records:
+            self.add(record)
+
+    def __len__(self) -> int:
+        return len(self._record_words)
+
+    def add(self, record: dict) -> None:
+        record_id = self.key(record) if callable(self.key) else record.get(self.key)
+        if not record_id:
+            return
+        if record_id in self._record_words:
+            self.remove(record_id)
+        words = {token for field in self.fields for token in tokenize(record.get(field))}
+        self._record_words[record_id] = words
+        for word in words:
+            holders = self._word_records.get(word)
+            if holders is None:
+                holders = self._word_records[word] = set()
+                grams = trigrams(word)
+                self._word_grams[word] = len(grams)
+                for gram in grams:
+                    self._gram_words.setdefault(gram, set()).add(word)
+            holders.add(record_id)
+
+    def update(self, record: dict) -> None:
+        self.add(record)
+
+    def remove(self, record_id) -> None:
+        words = self._record_words.pop(record_id, None)
+        if not words:
+            return
+        for word in words:
+            holders = self._word_records.get(word)
+            if holders is None:
+                continue
+            holders.discard(record_id)
+            if holders:
+                continue
+            del self._word_records[word]
+            del self._word_grams[word]
+            for gram in trigrams(word):
+                gram_words = self._gram_words.get(gram)
+                if gram_words is not None:
+                    gram_words.discard(word)
+                    if not gram_words:
+                        del self._gram_words[gram]
+
+    def similar_words(self, word: str, threshold: float = 0.4) -> dict[str, float]:
+        """Map indexed words to their similarity with ``word``."""
+        grams = trigrams(word)
+        shared: dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._gram_words.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        matches = {}
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + self._word_grams[candidate])
+            if score >= threshold:
+                matches[candidate] = score
+        return matches
+
+    def search(
+        self,
+        query: str,
+        limit: int | None = 20,
+        threshold: float = 0.4,
+        time_budget: float = FUZZY_TIME_BUDGET,
+    ) -> list[tuple]:
+        """Return ``(record_id, similarity)`` pairs, most similar first.
+
+        A record scores the mean of its best match for each query word, so
+        records resembling every word rank above those matching only one.
+        Once ``time_budget`` seconds pass, the remaining query words are
+        skipped and the candidates found so far are ranked.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+
+        deadline = time.perf_counter() + time_budget
+        totals: dict = {}
+        for word in words:
+            best: dict = {}
+            for candidate, score in self.similar_words(word, threshold).items():
+                for record_id in self._word_records[candidate]:
+                    if score > best.get(record_id, 0.0):
+                        best[record_id] = score
+            for record_id, score in best.items():
+                totals[record_id] = totals.get(record_id, 0.0) + score
+            if time.perf_counter() > deadline:
+                break
+
+        ranked = sorted(
+            ((record_id, total / len(words)) for record_id, total in totals.items()),
+            key=lambda item: (-item[1], str(item[0])),
+        )
+        return ranked[:limit] if limit is not None else ranked
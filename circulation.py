@@ -0,0 +1,116 @@
+"""Loan due dates, overdue detection and fine accrual."""
+
+from __future__ import annotations
+
+import bisect
+import itertools
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Late returns are charged per day past the due date.
+FINE_PER_DAY = 10
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def _today(today: date | None) -> date:
+    return today or date.today()
+
+
+def days_overdue(due_date: str, today: date | None = None) -> int:
+    """Return how many days past ``due_date`` it is (negative if not yet due)."""
+    return (_today(today) - datetime.strptime(due_date, DATE_FORMAT).date()).days
+
+
+def fine_for(due_date: str, today: date | None = None) -> int:
+    """Return the fine owed on a loan due on ``due_date``."""
+    return max(days_overdue(due_date, today), 0) * FINE_PER_DAY
+
+
+class DueDateIndex:
+    """Active loans kept sorted by due date.
+
+    Overdue and due-soon queries bisect the sorted keys, so they only touch
+    the loans they return rather than the whole transaction history.
+    """
+
+    def __init__(self, transactions: Iterable[dict] = ()):
+        self._keys: list[tuple[str, int]] = []
+        self._loans: dict[tuple[str, int], dict] = {}
+        self._key_by_id: dict = {}
+        self._counter = itertools.count()
+        for transaction in transactions:
+            self.add(transaction)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, transaction: dict) -> None:
+        if transaction['id'] in self._key_by_id:
+            self.remove(transaction['id'])
+        key = (transaction['due_date'], next(self._counter))
+        bisect.insort(self._keys, key)
+        self._loans[key] = transaction
+        self._key_by_id[transaction['id']] = key
+
+    def remove(self, transaction_id) -> None:
+        key = self._key_by_id.pop(transaction_id, None)
+        if key is None:
+            return
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+        self._loans.pop(key, None)
+
+    def _between(self, start: str | None, end: str | None) -> list[dict]:
+        lo = 0 if start is None else bisect.bisect_left(self._keys, (start,))
+        hi = len(self._keys) if end is None else bisect.bisect_left(self._keys, (end,))
+        return [self._loans[key] for key in self._keys[lo:hi]]
+
+    def overdue(self, today: date | None = None) -> list[dict]:
+        """Loans whose due date is before ``today``, most overdue first."""
+        return self._between(None, _today(today).strftime(DATE_FORMAT))
+
+    def due_within(self, days: int, today: date | None = None) -> list[dict]:
+        """Loans falling due from ``today`` through the next ``days`` days."""
+        start = _today(today)
+        end = start + timedelta(days=days + 1)
+        return self._between(start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT))
+
+
+class FineAccrualJob:
+    """Run ``accrue`` every ``interval`` seconds on a background thread.
+
+    The first run comes one ``interval`` after ``start``, so building the app
+    never triggers a save by itself.
+    """
+
+    def __init__(self, accrue: Callable[[], object], interval: float = 3600.0):
+        self.accrue = accrue
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='bookflow-fines', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Signal the thread and wait for any accrual in progress to finish."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.accrue()
+            except Exception:
+                logger.exception("Fine accrual failed")
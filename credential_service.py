@@ -0,0 +1,167 @@
+"""Password verification on a bounded pool of worker processes.
+
+hashlib releases the GIL while it runs PBKDF2 or scrypt, so a hash does not
+block other threads; what hurts during a login storm is that every sign-in
+burns a core for a few hundred milliseconds, unbounded. ``CredentialService``
+caps how many hashes run at once and how many requests may wait, and records
+how long requests queue and hash. The hashes run in worker processes so that
+one dying (scrypt's memory use can get it killed) costs only a rebuilt pool,
+not the Streamlit server.
+"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from security_utils import hash_password, verify_password
+
+
+class CredentialServiceBusy(RuntimeError):
+    """Raised when too many verifications are already queued."""
+
+
+def _int_setting(name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(name, default))
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+class CredentialService:
+    """Verify passwords in parallel with backpressure.
+
+    At most ``max_workers`` hashes run at once and at most ``max_pending``
+    requests may be in flight; further requests wait up to ``queue_timeout``
+    seconds for a slot and then raise ``CredentialServiceBusy``.
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        max_pending: int | None = None,
+        queue_timeout: float = 2.0,
+        result_timeout: float = 30.0,
+    ):
+        self.max_workers = max_workers or _int_setting('BOOKFLOW_HASH_WORKERS', os.cpu_count() or 1)
+        self.max_pending = max_pending or _int_setting('BOOKFLOW_HASH_QUEUE', self.max_workers * 4)
+        self.queue_timeout = queue_timeout
+        self.result_timeout = result_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected': 0,
+            'failed': 0,
+            'in_flight': 0,
+            'queue_seconds': 0.0,
+            'hash_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        }
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Spawned workers do not inherit the server's threads or locks.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _reset_pool(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _record(self, **changes) -> None:
+        with self._lock:
+            for name, value in changes.items():
+                if name == 'max_wait_seconds':
+                    self._stats[name] = max(self._stats[name], value)
+                else:
+                    self._stats[name] += value
+
+    def verify(self, password: str, password_hash: str | None, salt: str | None = None) -> bool:
+        """Check ``password`` against a stored hash on a worker process."""
+        if not password_hash:
+            return False
+        return self._run(verify_password, password, password_hash, salt)
+
+    def hash(self, password: str) -> str:
+        """Hash ``password`` with the configured parameters on a worker process."""
+        return self._run(hash_password, password)
+
+    def _run(self, func, *args):
+        queued = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._record(rejected=1)
+            raise CredentialServiceBusy('Too many sign-ins are being checked right now.')
+        self._record(submitted=1, in_flight=1)
+        try:
+            try:
+                future = self._pool().submit(_timed, func, *args)
+                result, hash_seconds = future.result(timeout=self.result_timeout)
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool and run this one inline.
+                self._reset_pool()
+                result, hash_seconds = _timed(func, *args)
+            except FutureTimeoutError:
+                self._record(failed=1)
+                raise CredentialServiceBusy('Sign-in check timed out; please try again.') from None
+            waited = time.perf_counter() - queued
+            self._record(
+                completed=1,
+                hash_seconds=hash_seconds,
+                queue_seconds=max(waited - hash_seconds, 0.0),
+                max_wait_seconds=waited,
+            )
+            return result
+        finally:
+            self._record(in_flight=-1)
+            self._slots.release()
+
+    def metrics(self) -> dict:
+        """Return counters plus average queue and hash times in milliseconds."""
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats['completed'] or 1
+        stats['avg_queue_ms'] = stats['queue_seconds'] * 1000 / completed
+        stats['avg_hash_ms'] = stats['hash_seconds'] * 1000 / completed
+        stats['max_wait_ms'] = stats.pop('max_wait_seconds') * 1000
+        stats['max_workers'] = self.max_workers
+        stats['max_pending'] = self.max_pending
+        return stats
+
+    def shutdown(self) -> None:
+        self._reset_pool()
+
+
+_service: CredentialService | None = None
+_service_lock = threading.Lock()
+
+
+def get_credential_service() -> CredentialService:
+    """Return the process-wide credential service, creating it on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = CredentialService()
+            atexit.register(_service.shutdown)
+        return _service
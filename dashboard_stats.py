@@ -0,0 +1,85 @@
+"""Running totals for the admin dashboard."""
+
+from __future__ import annotations
+
+import threading
+from typing import Iterable
+
+from ledger import TransactionLedger
+
+# Only these roles count towards the dashboard's user total.
+COUNTED_ROLES = ('students', 'teachers')
+
+
+class DashboardStats:
+    """Library-wide counters updated as events happen.
+
+    Every update is O(1); ``rebuild`` recounts everything from the loaded
+    data when the counters might have drifted (e.g. after a reload).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total_books = 0
+        self.total_users = 0
+        self.active_borrows = 0
+        self.total_fines = 0.0
+
+    def rebuild(self, program_books: dict[str, list], users: dict[str, list], transactions: Iterable[dict]) -> None:
+        total_books = sum(len(books) for books in program_books.values())
+        total_users = sum(len(users.get(role, [])) for role in COUNTED_ROLES)
+        if isinstance(transactions, TransactionLedger):
+            # Count straight from the columns instead of building row views.
+            active_borrows = transactions.status_count('borrowed')
+            total_fines = transactions.total_fines()
+        else:
+            active_borrows = 0
+            total_fines = 0.0
+            for transaction in transactions:
+                if transaction.get('status') == 'borrowed':
+                    active_borrows += 1
+                total_fines += float(transaction.get('fine', 0) or 0)
+        with self._lock:
+            self.total_books = total_books
+            self.total_users = total_users
+            self.active_borrows = active_borrows
+            self.total_fines = total_fines
+
+    def books_added(self, count: int = 1) -> None:
+        with self._lock:
+            self.total_books += count
+
+    def books_removed(self, count: int = 1) -> None:
+        with self._lock:
+            self.total_books -= count
+
+    def users_added(self, role_key: str, count: int = 1) -> None:
+        if role_key in COUNTED_ROLES:
+            with self._lock:
+                self.total_users += count
+
+    def users_removed(self, role_key: str, count: int = 1) -> None:
+        if role_key in COUNTED_ROLES:
+            with self._lock:
+                self.total_users -= count
+
+    def loan_opened(self) -> None:
+        with self._lock:
+            self.active_borrows += 1
+
+    def loan_closed(self) -> None:
+        with self._lock:
+            self.active_borrows -= 1
+
+    def fine_changed(self, old, new) -> None:
+        with self._lock:
+            self.total_fines += float(new or 0) - float(old or 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'total_books': self.total_books,
+                'total_users': self.total_users,
+                'active_borrows': self.active_borrows,
+                'total_fines': self.total_fines,
+            }
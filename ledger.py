@@ -0,0 +1,286 @@
+"""Column-oriented storage for the loan history.
+
+Transactions are appended to typed ``array`` columns: integer ids, loan
+dates as days since 1970-01-01, fines in paise, and user/book ids, names,
+titles, programmes and statuses as codes into per-column string tables.
+Rows only become dict-like ``LedgerRow`` views when something asks for them,
+and serialize back to the same JSON objects the old list of dicts produced.
+"""
+
+from __future__ import annotations
+
+from array import array
+from collections.abc import Mapping, MutableMapping, Sequence
+from datetime import date
+from functools import lru_cache
+
+FIELDS = (
+    'id',
+    'user_id',
+    'user_name',
+    'book_id',
+    'book_title',
+    'book_programme',
+    'borrow_date',
+    'due_date',
+    'return_date',
+    'status',
+    'fine',
+)
+ENCODED_FIELDS = ('user_id', 'user_name', 'book_id', 'book_title', 'book_programme', 'status')
+DATE_FIELDS = ('borrow_date', 'due_date', 'return_date')
+
+# Stored in date columns for ``None`` (and for rows without the field).
+NO_DATE = -(2 ** 31)
+# Stored in code columns for rows without the field.
+NO_CODE = -1
+
+_BITS = {name: 1 << position for position, name in enumerate(FIELDS)}
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def _parse_day(text: str) -> int | None:
+    try:
+        day = date.fromisoformat(text)
+    except ValueError:
+        return None
+    # Only canonical YYYY-MM-DD strings round-trip exactly.
+    return day.toordinal() - _EPOCH if day.isoformat() == text else None
+
+
+@lru_cache(maxsize=4096)
+def _day_text(day: int) -> str:
+    return date.fromordinal(day + _EPOCH).isoformat()
+
+
+class _StringTable:
+    """Dictionary encoding for one column: each distinct value gets a code."""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        self.values: list = []
+        self.codes: dict = {}
+
+    def encode(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TransactionLedger(Sequence):
+    """An append-only sequence of transactions stored column by column.
+
+    Values that do not fit their column (an id that is not an int, a date
+    that is not ``YYYY-MM-DD``) and fields the ledger does not know about are
+    kept per row in a small overflow dict, so nothing is lost.
+    """
+
+    def __init__(self, transactions=()):
+        self._ids = array('q')
+        self._fines = array('q')
+        self._present = array('H')
+        self._dates = {name: array('i') for name in DATE_FIELDS}
+        self._codes = {name: array('i') for name in ENCODED_FIELDS}
+        self._tables = {name: _StringTable() for name in ENCODED_FIELDS}
+        self._extra: dict[int, dict] = {}
+        for transaction in transactions:
+            self.add(transaction)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [LedgerRow(self, row) for row in range(*index.indices(len(self)))]
+        row = index + len(self) if index < 0 else index
+        if not 0 <= row < len(self):
+            raise IndexError('ledger index out of range')
+        return LedgerRow(self, row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield LedgerRow(self, row)
+
+    def add(self, transaction: Mapping) -> LedgerRow:
+        """Append ``transaction`` and return a view of the new row."""
+        row = len(self)
+        self._ids.append(0)
+        self._fines.append(0)
+        self._present.append(0)
+        for column in self._dates.values():
+            column.append(NO_DATE)
+        for column in self._codes.values():
+            column.append(NO_CODE)
+        for key, value in transaction.items():
+            self._set(row, key, value)
+        return LedgerRow(self, row)
+
+    def append(self, transaction: Mapping) -> None:
+        self.add(transaction)
+
+    def extend(self, transactions) -> None:
+        for transaction in transactions:
+            self.add(transaction)
+
+    def _store(self, row: int, key: str, value) -> bool:
+        """Write ``value`` into its column; False if it does not fit."""
+        if key == 'id':
+            if type(value) is not int or not -(2 ** 63) <= value < 2 ** 63:
+                return False
+            self._ids[row] = value
+        elif key == 'fine':
+            if type(value) not in (int, float):
+                return False
+            paise = round(value * 100)
+            if paise / 100 != value or not -(2 ** 63) <= paise < 2 ** 63:
+                return False
+            self._fines[row] = paise
+        elif key in self._dates:
+            if value is None:
+                day = NO_DATE
+            elif type(value) is str:
+                day = _parse_day(value)
+                if day is None:
+                    return False
+            else:
+                return False
+            self._dates[key][row] = day
+        else:
+            if value is not None and type(value) is not str:
+                return False
+            self._codes[key][row] = self._tables[key].encode(value)
+        return True
+
+    def _set(self, row: int, key, value) -> None:
+        extra = self._extra.get(row)
+        if extra is not None and key in extra:
+            del extra[key]
+            if not extra:
+                del self._extra[row]
+        bit = _BITS.get(key)
+        if bit is not None:
+            if self._store(row, key, value):
+                self._present[row] |= bit
+                return
+            self._clear(row, key)
+        self._extra.setdefault(row, {})[key] = value
+
+    def _get(self, row: int, key):
+        extra = self._extra.get(row)
+        if extra is not None and key in extra:
+            return extra[key]
+        bit = _BITS.get(key)
+        if bit is None or not self._present[row] & bit:
+            raise KeyError(key)
+        if key == 'id':
+            return self._ids[row]
+        if key == 'fine':
+            paise = self._fines[row]
+            return paise // 100 if paise % 100 == 0 else paise / 100
+        if key in self._dates:
+            day = self._dates[key][row]
+            return None if day == NO_DATE else _day_text(day)
+        return self._tables[key].values[self._codes[key][row]]
+
+    def _delete(self, row: int, key) -> None:
+        extra = self._extra.get(row)
+        if extra is not None and key in extra:
+            del extra[key]
+            if not extra:
+                del self._extra[row]
+            return
+        bit = _BITS.get(key)
+        if bit is None or not self._present[row] & bit:
+            raise KeyError(key)
+        self._clear(row, key)
+
+    def _clear(self, row: int, key: str) -> None:
+        """Reset a column cell so scans over the column skip this row."""
+        self._present[row] &= ~_BITS[key]
+        if key == 'id':
+            self._ids[row] = 0
+        elif key == 'fine':
+            self._fines[row] = 0
+        elif key in self._dates:
+            self._dates[key][row] = NO_DATE
+        else:
+            self._codes[key][row] = NO_CODE
+
+    def _keys(self, row: int):
+        present = self._present[row]
+        extra = self._extra.get(row) or {}
+        for key in FIELDS:
+            if present & _BITS[key] or key in extra:
+                yield key
+        for key in extra:
+            if key not in _BITS:
+                yield key
+
+    def column(self, name: str):
+        """Return the raw column for ``name``.
+
+        Dates are days since 1970-01-01 (``NO_DATE`` for none), fines are in
+        paise; encoded fields return ``(codes, values)`` where ``NO_CODE``
+        marks rows without the field.
+        """
+        if name == 'id':
+            return self._ids
+        if name == 'fine':
+            return self._fines
+        if name in self._dates:
+            return self._dates[name]
+        return self._codes[name], self._tables[name].values
+
+    def is_regular(self) -> bool:
+        """True when every known field is held in its column (none overflowed)."""
+        return not any(key in _BITS for extra in self._extra.values() for key in extra)
+
+    def status_count(self, status: str) -> int:
+        code = self._tables['status'].codes.get(status)
+        count = 0 if code is None else self._codes['status'].count(code)
+        for extra in self._extra.values():
+            if extra.get('status') == status:
+                count += 1
+        return count
+
+    def total_fines(self) -> float:
+        total = sum(self._fines) / 100
+        for extra in self._extra.values():
+            if 'fine' in extra:
+                total += float(extra['fine'] or 0)
+        return total
+
+
+class LedgerRow(MutableMapping):
+    """A dict-like view of one ledger row; writes go straight to the columns."""
+
+    __slots__ = ('ledger', 'row')
+
+    def __init__(self, ledger: TransactionLedger, row: int):
+        self.ledger = ledger
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.ledger._get(self.row, key)
+
+    def __setitem__(self, key, value) -> None:
+        self.ledger._set(self.row, key, value)
+
+    def __delitem__(self, key) -> None:
+        self.ledger._delete(self.row, key)
+
+    def __iter__(self):
+        return self.ledger._keys(self.row)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
@@ -0,0 +1,570 @@
+"""Email notifications for BookFlow.
+
+Messages are written to a persistent outbox and delivered by a background
+worker, so a slow or unreachable SMTP server never blocks a page. Failed
+deliveries are retried with exponential backoff. Several processes can share
+one outbox file.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import smtplib
+import ssl
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from email import policy
+from email.message import EmailMessage
+from email.parser import Parser
+
+from storage import FileLock, FsyncPolicy, atomic_write_json
+
+
+def _email_setting(name: str) -> str | None:
+    value = os.getenv(name)
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+def _int_setting(name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(name, default))
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+
+class SmtpSettings:
+    """Connection details for the outgoing mail server.
+
+    ``security`` is ``ssl`` (implicit TLS), ``starttls`` or ``none``. The last
+    one talks plain SMTP without logging in, for a local stand-in server.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        port: int,
+        username: str | None,
+        password: str | None,
+        sender: str,
+        security: str = 'ssl',
+        timeout: float = 20.0,
+    ):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.security = security
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls) -> tuple[SmtpSettings | None, str | None]:
+        """Read the BOOKFLOW_SMTP_* settings.
+
+        Returns ``(settings, None)`` or ``(None, error)`` when they are
+        incomplete or invalid.
+        """
+        server = _email_setting("BOOKFLOW_SMTP_SERVER")
+        port_text = _email_setting("BOOKFLOW_SMTP_PORT") or "465"
+        username = _email_setting("BOOKFLOW_SMTP_USERNAME")
+        password = _email_setting("BOOKFLOW_SMTP_PASSWORD")
+        sender = _email_setting("BOOKFLOW_EMAIL_SENDER") or username
+
+        try:
+            port = int(port_text)
+        except ValueError:
+            return None, f"Invalid SMTP port: {port_text}"
+
+        security = (_email_setting("BOOKFLOW_SMTP_SECURITY") or ('ssl' if port == 465 else 'starttls')).lower()
+        if security not in ('ssl', 'starttls', 'none'):
+            return None, f"Invalid SMTP security mode: {security}"
+
+        required = [server, sender] if security == 'none' else [server, username, password, sender]
+        if not all(required):
+            return None, (
+                "SMTP settings are incomplete. Set BOOKFLOW_SMTP_SERVER, BOOKFLOW_SMTP_PORT, "
+                "BOOKFLOW_SMTP_USERNAME, BOOKFLOW_SMTP_PASSWORD, and BOOKFLOW_EMAIL_SENDER."
+            )
+        return cls(server, port, username, password, sender, security), None
+
+    def connect(self) -> smtplib.SMTP:
+        """Open and authenticate a connection to the server."""
+        if self.security == 'ssl':
+            server = smtplib.SMTP_SSL(
+                self.server, self.port, timeout=self.timeout, context=ssl.create_default_context()
+            )
+        else:
+            server = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+            if self.security == 'starttls':
+                server.ehlo()
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+        try:
+            if self.security != 'none':
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+
+class SmtpTransport:
+    """Deliver each message over its own SMTP connection."""
+
+    def __init__(self, settings: SmtpSettings):
+        self.settings = settings
+
+    def send(self, message: EmailMessage) -> None:
+        with self.settings.connect() as server:
+            server.send_message(message)
+
+
+def _connection_lost(exc: OSError) -> bool:
+    """True when ``exc`` means the connection is gone rather than the message refused.
+
+    ``SMTPException`` subclasses ``OSError``, so server replies are told apart
+    from socket errors explicitly.
+    """
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return not isinstance(exc, smtplib.SMTPException)
+
+
+class PooledSmtpTransport:
+    """Deliver messages over a small pool of reused, logged-in connections.
+
+    Idle connections are checked with NOOP before reuse and replaced when the
+    server has dropped them. ``send_batch`` sends several messages over one
+    connection and records the batch's throughput in ``batch_stats()``.
+    """
+
+    def __init__(
+        self,
+        settings: SmtpSettings,
+        size: int = 2,
+        batch_size: int = 50,
+        max_idle: float = 60.0,
+        history: int = 100,
+    ):
+        self.settings = settings
+        self.size = size
+        self.batch_size = batch_size
+        self.max_idle = max_idle
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self._batches: deque[dict] = deque(maxlen=history)
+
+    @staticmethod
+    def _alive(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _checkout(self) -> smtplib.SMTP | None:
+        """Return a live idle connection, or None if a new one is needed."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.max_idle and self._alive(server):
+                return server
+            self._close(server)
+
+    def send(self, message: EmailMessage) -> None:
+        error = self.send_batch([message])[0]
+        if error is not None:
+            raise error
+
+    def send_batch(self, messages: list[EmailMessage]) -> list[Exception | None]:
+        """Send ``messages`` over one pooled connection.
+
+        Returns one entry per message: None when it was accepted, otherwise
+        the exception it failed with. A dropped connection is re-opened once
+        per message.
+        """
+        started = time.perf_counter()
+        results: list[Exception | None] = []
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._checkout()
+            for message in messages:
+                for attempt in (1, 2):
+                    try:
+                        if server is None:
+                            server = self.settings.connect()
+                        server.send_message(message)
+                        results.append(None)
+                        break
+                    except OSError as exc:
+                        if not _connection_lost(exc):
+                            results.append(exc)
+                            break
+                        if server is not None:
+                            self._close(server)
+                            server = None
+                        if attempt == 2:
+                            results.append(exc)
+        finally:
+            if server is not None:
+                with self._lock:
+                    self._idle.append((server, time.monotonic()))
+            self._slots.release()
+
+        elapsed = time.perf_counter() - started
+        sent = results.count(None)
+        with self._lock:
+            self._batches.append({
+                'finished_at': time.time(),
+                'size': len(messages),
+                'sent': sent,
+                'failed': len(messages) - sent,
+                'seconds': elapsed,
+                'messages_per_second': sent / elapsed if elapsed > 0 else 0.0,
+            })
+        return results
+
+    def batch_stats(self) -> list[dict]:
+        """Return throughput figures for recent batches, oldest first."""
+        with self._lock:
+            return list(self._batches)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+
+# These errors will not go away by retrying the same message.
+PERMANENT_ERRORS = (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused, smtplib.SMTPNotSupportedError)
+
+
+def describe_error(exc: Exception) -> str:
+    """Turn an SMTP exception into a short message for the UI."""
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        detail = exc.smtp_error.decode("utf-8", errors="ignore").strip() if exc.smtp_error else ''
+        return f"Authentication failed: {detail}" if detail else "Authentication failed: check username/app password."
+    if isinstance(exc, smtplib.SMTPConnectError):
+        detail = exc.smtp_error.decode("utf-8", errors="ignore") if exc.smtp_error else exc
+        return f"Connection error: {detail}"
+    return str(exc) or type(exc).__name__
+
+
+def build_reservation_message(sender: str, to_email: str, user_name: str, book: dict, reservation: dict) -> EmailMessage:
+    book_title = book.get('title', 'Requested Book')
+    programme = book.get('programme') or 'General Library'
+    reserved_at = reservation.get('reserved_at', datetime.now().strftime('%Y-%m-%d %H:%M'))
+
+    message = EmailMessage()
+    message["Subject"] = f"Reservation confirmed for \"{book_title}\""
+    message["From"] = sender
+    message["To"] = to_email
+    message.set_content(
+        f"Hello {user_name},\n\n"
+        f"We've recorded your reservation for \"{book_title}\" in the BookFlow library.\n\n"
+        f"Reservation details:\n"
+        f"• Programme: {programme}\n"
+        f"• Reservation ID: {reservation.get('id')}\n"
+        f"• Reserved on: {reserved_at}\n\n"
+        "We'll notify you as soon as a copy becomes available.\n\n"
+        "Thank you for using BookFlow!"
+    )
+    return message
+
+
+def build_hold_message(sender: str, to_email: str, user_name: str, book: dict, reservation: dict) -> EmailMessage:
+    book_title = book.get('title', 'Requested Book')
+
+    message = EmailMessage()
+    message["Subject"] = f"\"{book_title}\" is ready for you"
+    message["From"] = sender
+    message["To"] = to_email
+    message.set_content(
+        f"Hello {user_name},\n\n"
+        f"Good news! A copy of \"{book_title}\" has been returned and is being held for you.\n\n"
+        f"Hold details:\n"
+        f"• Reservation ID: {reservation.get('id')}\n"
+        f"• Held until: {reservation.get('hold_expires_at')}\n\n"
+        "Borrow it from BookFlow before then, or the copy passes to the next reader in the queue.\n\n"
+        "Thank you for using BookFlow!"
+    )
+    return message
+
+
+class EmailOutbox:
+    """Persistent queue of outgoing messages with a delivery worker.
+
+    Entries are kept in a JSON file so queued mail survives restarts. The
+    worker retries failures after ``base_delay * 2 ** (attempts - 1)``
+    seconds (capped at ``max_delay``, with jitter) and gives up after
+    ``max_attempts`` tries or on a permanent SMTP error.
+
+    The file is the shared state for every process using it: each change is
+    a read-modify-write under a file lock. A worker claims a batch for
+    ``claim_timeout`` seconds; entries whose claim ran out (their process
+    died mid-delivery) are sent again. Workers also look for mail queued by
+    other processes every ``poll_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        transport=None,
+        sender: str | None = None,
+        max_attempts: int = 6,
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0,
+        retention: float = 7 * 24 * 3600,
+        workers: int = 2,
+        fsync: FsyncPolicy | None = None,
+        claim_timeout: float = 600.0,
+        poll_interval: float = 30.0,
+    ):
+        self.path = path
+        self.fsync = fsync or FsyncPolicy.from_env()
+        self.transport = transport
+        self.sender = sender
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retention = retention
+        self.workers = workers
+        self.claim_timeout = claim_timeout
+        self.poll_interval = poll_interval
+        self._owner = f"{os.getpid()}-{random.randrange(16 ** 8):08x}"
+        self._file_lock = FileLock(f"{path}.lock")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads: list[threading.Thread] = []
+        self._entries: dict[str, dict] = {}
+        with self._lock, self._file_lock:
+            self._load()
+
+    def _load(self) -> None:
+        """Replace the cached entries with the file's. Hold both locks."""
+        if not os.path.exists(self.path):
+            self._entries = {}
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                entries = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return
+        self._entries = {entry['id']: entry for entry in entries}
+
+    def _save(self) -> None:
+        # Finished entries are only kept long enough to report their status.
+        cutoff = time.time() - self.retention
+        for message_id in [
+            message_id
+            for message_id, entry in self._entries.items()
+            if entry['status'] in ('sent', 'failed') and entry['created_at'] < cutoff
+        ]:
+            del self._entries[message_id]
+        atomic_write_json(self.path, list(self._entries.values()), fsync=self.fsync)
+
+    def configure(self) -> str | None:
+        """Set up SMTP delivery from the environment if no transport was given.
+
+        Returns an error message when the settings are unusable.
+        """
+        with self._lock:
+            if self.transport is None:
+                settings, error = SmtpSettings.from_env()
+                if settings is None:
+                    return error
+                self.transport = PooledSmtpTransport(
+                    settings,
+                    size=_int_setting('BOOKFLOW_SMTP_POOL_SIZE', 2),
+                    batch_size=_int_setting('BOOKFLOW_SMTP_BATCH_SIZE', 50),
+                )
+                self.sender = self.sender or settings.sender
+        return None
+
+    def enqueue(self, message: EmailMessage, kind: str = 'email', reference: str | None = None) -> dict:
+        """Store ``message`` for delivery and return its outbox entry."""
+        now = time.time()
+        entry = {
+            'id': f"MSG{datetime.now().strftime('%Y%m%d%H%M%S')}{random.randrange(16 ** 6):06x}",
+            'kind': kind,
+            'reference': reference,
+            'to': message.get('To'),
+            'subject': message.get('Subject'),
+            'raw': message.as_string(),
+            'status': 'queued',
+            'attempts': 0,
+            'created_at': now,
+            'next_attempt_at': now,
+            'last_error': None,
+        }
+        with self._lock, self._file_lock:
+            self._load()
+            self._entries[entry['id']] = entry
+            self._save()
+            self._wakeup.notify()
+        self.start()
+        return dict(entry)
+
+    def status(self, message_id: str) -> dict | None:
+        with self._lock, self._file_lock:
+            self._load()
+            entry = self._entries.get(message_id)
+            return dict(entry) if entry else None
+
+    def pending_count(self) -> int:
+        with self._lock, self._file_lock:
+            self._load()
+            return sum(entry['status'] in ('queued', 'sending') for entry in self._entries.values())
+
+    def start(self) -> None:
+        """Start the delivery workers if they are not running."""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            self._stopping = False
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name=f'bookflow-outbox-{len(self._threads) + 1}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout)
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+
+    def batch_stats(self) -> list[dict]:
+        """Return per-batch throughput from the transport, when it keeps any."""
+        stats = getattr(self.transport, 'batch_stats', None)
+        return stats() if stats is not None else []
+
+    def _claim_batch(self) -> tuple[list[dict], float | None]:
+        """Claim up to one batch of due entries for this process.
+
+        Returns the claimed entries and, when none are due, how long until
+        the next one is. Call with ``_lock`` held.
+        """
+        with self._file_lock:
+            self._load()
+            now = time.time()
+            due, wait = [], None
+            for entry in self._entries.values():
+                if entry['status'] == 'queued':
+                    due_at = entry['next_attempt_at']
+                elif entry['status'] == 'sending':
+                    # Entries saved before claims expired are free at once.
+                    due_at = entry.get('claimed_until', 0)
+                else:
+                    continue
+                delay = due_at - now
+                if delay <= 0:
+                    due.append(entry)
+                elif wait is None or delay < wait:
+                    wait = delay
+            due.sort(key=lambda entry: entry['next_attempt_at'])
+            batch = due[:getattr(self.transport, 'batch_size', 1)]
+            for entry in batch:
+                entry['status'] = 'sending'
+                entry['attempts'] += 1
+                entry['claimed_by'] = self._owner
+                entry['claimed_until'] = now + self.claim_timeout
+            if batch:
+                self._save()
+        return batch, wait
+
+    def _claimed(self, message_id: str) -> dict | None:
+        """Return the entry if this process still holds its claim."""
+        entry = self._entries.get(message_id)
+        if entry is None or entry['status'] != 'sending' or entry.get('claimed_by') != self._owner:
+            return None
+        return entry
+
+    @staticmethod
+    def _release(entry: dict, status: str) -> None:
+        entry['status'] = status
+        entry.pop('claimed_by', None)
+        entry.pop('claimed_until', None)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                batch, wait = self._claim_batch()
+                while not batch and not self._stopping:
+                    self._wakeup.wait(self.poll_interval if wait is None else min(wait, self.poll_interval))
+                    batch, wait = self._claim_batch()
+                if self._stopping:
+                    if batch:
+                        with self._file_lock:
+                            self._load()
+                            for claimed in batch:
+                                entry = self._claimed(claimed['id'])
+                                if entry is not None:
+                                    self._release(entry, 'queued')
+                            self._save()
+                    return
+                raws = [entry['raw'] for entry in batch]
+            self._deliver(batch, raws)
+
+    def _deliver(self, batch: list[dict], raws: list[str]) -> None:
+        parser = Parser(policy=policy.default)
+        try:
+            config_error = self.configure()
+            if config_error:
+                raise RuntimeError(config_error)
+            messages = [parser.parsestr(raw) for raw in raws]
+            send_batch = getattr(self.transport, 'send_batch', None)
+            if send_batch is not None:
+                results = send_batch(messages)
+            else:
+                results = []
+                for message in messages:
+                    try:
+                        self.transport.send(message)
+                        results.append(None)
+                    except Exception as exc:
+                        results.append(exc)
+        except Exception as exc:
+            results = [exc] * len(batch)
+
+        with self._lock, self._file_lock:
+            self._load()
+            now = time.time()
+            for claimed, error in zip(batch, results):
+                entry = self._claimed(claimed['id'])
+                if entry is None:
+                    # Our claim ran out and another worker took the entry over.
+                    continue
+                entry['last_error'] = describe_error(error) if error is not None else None
+                if error is None:
+                    self._release(entry, 'sent')
+                    entry['sent_at'] = now
+                elif isinstance(error, PERMANENT_ERRORS) or entry['attempts'] >= self.max_attempts:
+                    self._release(entry, 'failed')
+                else:
+                    delay = min(self.base_delay * 2 ** (entry['attempts'] - 1), self.max_delay)
+                    self._release(entry, 'queued')
+                    entry['next_attempt_at'] = now + delay * random.uniform(0.8, 1.2)
+            self._save()
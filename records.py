@@ -0,0 +1,342 @@
+"""Compact record types for the loaded library data.
+
+Books, users and reservations are ``Record`` subclasses: they
+behave like the dicts they replace and serialize to the same JSON, but their
+known fields live in ``__slots__`` and are normalized to one type when they
+are set, so readers never need to coerce them.
+
+Every programme gets its own copy of its category's template books, which
+adds up to more than a thousand near-identical dicts. A ``ProgramBook`` keeps
+a reference to a shared, read-only ``BookTemplate`` and a shared
+``Programme`` and only stores what differs per programme: its copies, its
+available count and any edited fields. Ids, titles and PDF links are derived
+when they are read.
+"""
+
+from __future__ import annotations
+
+import re
+import sys
+from collections.abc import Mapping, MutableMapping, Sequence
+from types import MappingProxyType
+
+# Marks a template field that was deleted from one programme's copy.
+_DELETED = object()
+
+# Fields every programme copy has in addition to the template's own.
+_PROGRAM_FIELDS = (
+    'title',
+    'original_title',
+    'title_signature',
+    'copies',
+    'available',
+    'programme',
+    'program_category',
+    'catalog_type',
+    'subject',
+)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def program_title(base_title: str | None, programme: str, slug: str, signature_base: str) -> str:
+    """Ensure programme-specific titles stay readable and distinct."""
+
+    title = base_title.strip() if isinstance(base_title, str) else ""
+    programme_label = re.sub(r"\s+", " ", programme).strip() if isinstance(programme, str) else slug
+
+    if title:
+        # Avoid duplicating programme info if already present.
+        if programme_label and programme_label.lower() in title.lower():
+            return title
+        return f"{title} ({programme_label})" if programme_label else title
+
+    programme_label = programme_label or slug or "Programme"
+    return f"{programme_label} Resource {signature_base}"
+
+
+def book_key(book: Mapping) -> tuple[str, str]:
+    """Identify a catalogue book by its programme and id.
+
+    Slugs are cut to eight letters, so programmes can share book ids (both
+    B.Tech electronics programmes have an ``ENG001_BTECHELE``).
+    """
+    return book.get('programme') or '', book['id']
+
+
+def loaned_book_key(record: Mapping) -> tuple[str, str]:
+    """``book_key`` of the book a transaction or reservation refers to."""
+    return record.get('book_programme') or record.get('programme') or '', record['book_id']
+
+
+def json_default(value):
+    """``json.dump`` hook that writes records as objects and ledgers as arrays."""
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Sequence):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Programme:
+    """A programme's name, category and id slug, shared by all its books."""
+
+    __slots__ = ('name', 'category', 'slug')
+
+    def __init__(self, name: str, category: str, slug: str):
+        self.name = sys.intern(name)
+        self.category = sys.intern(category)
+        self.slug = sys.intern(slug)
+
+
+class BookTemplate:
+    """The fields every programme's copy of one default book has in common."""
+
+    __slots__ = ('base_id', 'signature', 'fields', 'keys')
+
+    def __init__(self, template: dict, subject: str | None):
+        fields = {key: _intern(value) for key, value in template.items()}
+        self.base_id = fields['id']
+        self.signature = re.sub(r"[^A-Z0-9]", "", self.base_id.upper()) or self.base_id.upper()
+        title = fields.get('title')
+        fields['original_title'] = title if isinstance(title, str) else None
+        fields['copies'] = max(int(fields.get('copies', 1)), 1)
+        fields['subject'] = _intern(subject)
+        pdf_url = fields.get('pdf_url')
+        if isinstance(pdf_url, str) and pdf_url.strip():
+            fields['pdf_url'] = pdf_url.strip()
+        else:
+            fields.pop('pdf_url', None)
+        self.keys = tuple(key for key in template if key in fields) + tuple(
+            key for key in _PROGRAM_FIELDS if key not in template
+        )
+        self.fields = MappingProxyType(fields)
+
+
+class ProgramBook(MutableMapping):
+    """One programme's copy of a template book, usable like a dict.
+
+    Writes that match the derived value are not stored, so a book only grows
+    an overlay once it is actually edited.
+    """
+
+    __slots__ = ('template', 'programme', '_copies', '_available', '_changes')
+
+    def __init__(self, template: BookTemplate, programme: Programme, available: int | None = None):
+        self.template = template
+        self.programme = programme
+        self._copies = template.fields['copies']
+        self._available = self._copies if available is None else available
+        self._changes: dict | None = None
+
+    @classmethod
+    def from_dict(cls, template: BookTemplate, programme: Programme, book: Mapping) -> ProgramBook:
+        """Compact a stored book, keeping whatever differs from the template."""
+        record = cls(template, programme)
+        for key, value in book.items():
+            record[key] = value
+        for key in template.keys:
+            if key not in book:
+                del record[key]
+        return record
+
+    def _derived(self, key: str):
+        template, programme = self.template, self.programme
+        if key == 'id':
+            return f"{template.base_id}_{programme.slug}"
+        if key == 'title':
+            return program_title(
+                template.fields['original_title'], programme.name, programme.slug, template.signature
+            )
+        if key == 'title_signature':
+            return f"{programme.slug}:{template.signature}"
+        if key == 'copies':
+            return self._copies
+        if key == 'available':
+            return self._available
+        if key == 'programme':
+            return programme.name
+        if key == 'program_category':
+            return programme.category
+        if key == 'catalog_type':
+            return 'program'
+        if key == 'pdf_url' and 'pdf_url' in template.fields:
+            pdf_url = template.fields['pdf_url']
+            delimiter = '&' if '?' in pdf_url else '?'
+            return f"{pdf_url}{delimiter}programme={programme.slug}"
+        return template.fields[key]
+
+    def __getitem__(self, key):
+        if self._changes is not None and key in self._changes:
+            value = self._changes[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        if key not in self.template.keys:
+            raise KeyError(key)
+        return self._derived(key)
+
+    def __setitem__(self, key, value) -> None:
+        if key in ('copies', 'available'):
+            setattr(self, '_' + key, int(value))
+            if self._changes is not None:
+                self._changes.pop(key, None)
+            return
+        if key in self.template.keys and self._derived(key) == value:
+            if self._changes is not None:
+                self._changes.pop(key, None)
+            return
+        if self._changes is None:
+            self._changes = {}
+        self._changes[key] = _intern(value)
+
+    def __delitem__(self, key) -> None:
+        self[key]  # raises KeyError for missing keys, like dict
+        if key in self.template.keys:
+            if self._changes is None:
+                self._changes = {}
+            self._changes[key] = _DELETED
+        else:
+            del self._changes[key]
+
+    def __iter__(self):
+        changes = self._changes or {}
+        for key in self.template.keys:
+            if changes.get(key) is not _DELETED:
+                yield key
+        for key, value in changes.items():
+            if key not in self.template.keys and value is not _DELETED:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Record(MutableMapping):
+    """A dict-compatible record whose known fields live in slots.
+
+    Subclasses list their fields in ``__slots__``. Fields that were never set
+    stay unset, so a record lists exactly the keys it was loaded with; keys a
+    subclass does not know about go into a small overflow dict. ``TYPES``
+    maps fields to the function that normalizes them on assignment.
+    """
+
+    __slots__ = ('_extra',)
+    TYPES: dict = {}
+    _fields: tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(cls.__dict__.get('__slots__', ()))
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, data: Mapping = (), **fields):
+        self._extra: dict | None = None
+        for key, value in dict(data, **fields).items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data: Mapping):
+        """Return ``data`` as this record type, validating its fields."""
+        return data if isinstance(data, cls) else cls(data)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value) -> None:
+        convert = self.TYPES.get(key)
+        if convert is not None and value is not None:
+            try:
+                value = convert(value)
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"{type(self).__name__} field {key!r}: {exc}") from None
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key) -> None:
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for name in self._fields:
+            if hasattr(self, name):
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Book(Record):
+    """A teacher, collection or library book that has no shared template."""
+
+    __slots__ = (
+        'id', 'title', 'author', 'copies', 'available', 'subject', 'pdf_url', 'format',
+        'borrowable', 'issue_date', 'programme', 'program_category', 'catalog_type',
+        'collection', 'original_title', 'title_signature', 'category', 'isbn', 'description',
+    )
+    TYPES = {
+        'copies': int,
+        'available': int,
+        'borrowable': bool,
+        'subject': _intern,
+        'format': _intern,
+        'programme': _intern,
+        'program_category': _intern,
+        'catalog_type': _intern,
+        'collection': _intern,
+    }
+
+
+class User(Record):
+    __slots__ = (
+        'id', 'username', 'name', 'contact', 'email', 'programme', 'password_hash', 'password_salt',
+    )
+    TYPES = {'id': str, 'username': str, 'programme': _intern}
+
+
+class Reservation(Record):
+    __slots__ = (
+        'id', 'seq', 'book_id', 'book_title', 'programme', 'user_id', 'user_name', 'user_email',
+        'status', 'reserved_at', 'held_at', 'hold_expires_at', 'closed_at',
+    )
+    TYPES = {'seq': int, 'status': _intern, 'programme': _intern}
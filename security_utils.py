@@ -1,13 +1,48 @@
 import base64
 import hashlib
 import hmac
+import multiprocessing
 import os
-from typing import Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List
 
-# These defaults keep password hashing consistent across the app.
+# Password hashes are stored as self-describing records such as
+# ``pbkdf2_sha256$260000$<salt>$<hash>`` or ``scrypt$16384$8$1$<salt>$<hash>``
+# so the parameters can change without invalidating existing users.
 _PBKDF2_ALGORITHM = "sha256"
-_PBKDF2_ITERATIONS = 260_000
+_PBKDF2_SCHEME = "pbkdf2_sha256"
+_SCRYPT_SCHEME = "scrypt"
 _SALT_BYTES = 16
+_SCRYPT_KEY_BYTES = 32
+
+# Iterations used by hashes written before records carried their parameters.
+_LEGACY_PBKDF2_ITERATIONS = 260_000
+
+# Smaller batches are hashed inline; starting worker processes costs more.
+_PARALLEL_MIN_BATCH = 4
+
+
+def _int_setting(name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(name, default))
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+
+def _scheme_setting() -> str:
+    scheme = os.getenv("BOOKFLOW_PASSWORD_SCHEME", _PBKDF2_SCHEME).strip().lower()
+    if scheme == _SCRYPT_SCHEME and hasattr(hashlib, "scrypt"):
+        return _SCRYPT_SCHEME
+    return _PBKDF2_SCHEME
+
+
+# These settings decide how new and upgraded hashes are written.
+PASSWORD_SCHEME = _scheme_setting()
+_PBKDF2_ITERATIONS = _int_setting("BOOKFLOW_PBKDF2_ITERATIONS", _LEGACY_PBKDF2_ITERATIONS)
+_SCRYPT_N = _int_setting("BOOKFLOW_SCRYPT_N", 2 ** 14)
+_SCRYPT_R = _int_setting("BOOKFLOW_SCRYPT_R", 8)
+_SCRYPT_P = _int_setting("BOOKFLOW_SCRYPT_P", 1)
 
 
 def _decode_salt(salt: str) -> bytes:
@@ -23,42 +58,133 @@ def generate_salt() -> str:
     return _encode_bytes(os.urandom(_SALT_BYTES))
 
 
-def hash_password(password: str, salt: str | None = None) -> Tuple[str, str]:
-    """Create a PBKDF2 hash for the provided password.
-
-    Returns a tuple of (password_hash, salt) where both values are base64 strings.
-    """
-    if salt is None:
-        salt = generate_salt()
-
-    password_hash = hashlib.pbkdf2_hmac(
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    derived = hashlib.pbkdf2_hmac(
         _PBKDF2_ALGORITHM,
         password.encode("utf-8"),
         _decode_salt(salt),
-        _PBKDF2_ITERATIONS,
+        iterations,
+    )
+    return _encode_bytes(derived)
+
+
+def _scrypt(password: str, salt: str, n: int, r: int, p: int) -> str:
+    derived = hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=_decode_salt(salt),
+        n=n,
+        r=r,
+        p=p,
+        maxmem=128 * n * r * p + 1024 * 1024,
+        dklen=_SCRYPT_KEY_BYTES,
     )
+    return _encode_bytes(derived)
+
+
+def hash_password(password: str, salt: str | None = None) -> str:
+    """Hash ``password`` with the configured scheme and return the record."""
+    if salt is None:
+        salt = generate_salt()
+
+    if PASSWORD_SCHEME == _SCRYPT_SCHEME:
+        derived = _scrypt(password, salt, _SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+        return f"{_SCRYPT_SCHEME}${_SCRYPT_N}${_SCRYPT_R}${_SCRYPT_P}${salt}${derived}"
+
+    derived = _pbkdf2(password, salt, _PBKDF2_ITERATIONS)
+    return f"{_PBKDF2_SCHEME}${_PBKDF2_ITERATIONS}${salt}${derived}"
 
-    return _encode_bytes(password_hash), salt
 
+def verify_password(password: str, password_hash: str | None, salt: str | None = None) -> bool:
+    """Verify a plaintext password against a stored hash record.
 
-def verify_password(password: str, password_hash: str | None, salt: str | None) -> bool:
-    """Verify a plaintext password against a stored hash and salt."""
-    if not password_hash or not salt:
+    Legacy hashes without a record prefix need the separately stored salt.
+    """
+    if not password_hash:
+        return False
+
+    parts = password_hash.split("$")
+    try:
+        if parts[0] == _PBKDF2_SCHEME and len(parts) == 4:
+            candidate = _pbkdf2(password, parts[2], int(parts[1]))
+        elif parts[0] == _SCRYPT_SCHEME and len(parts) == 6:
+            if not hasattr(hashlib, "scrypt"):
+                return False
+            candidate = _scrypt(password, parts[4], int(parts[1]), int(parts[2]), int(parts[3]))
+        elif len(parts) == 1 and salt:
+            return hmac.compare_digest(_pbkdf2(password, salt, _LEGACY_PBKDF2_ITERATIONS), password_hash)
+        else:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(candidate, parts[-1])
+
+
+def needs_rehash(password_hash: str | None) -> bool:
+    """Return True when a stored hash does not use the configured parameters."""
+    if not password_hash:
         return False
+    parts = password_hash.split("$")
+    if PASSWORD_SCHEME == _SCRYPT_SCHEME:
+        return parts[:4] != [_SCRYPT_SCHEME, str(_SCRYPT_N), str(_SCRYPT_R), str(_SCRYPT_P)]
+    return parts[:2] != [_PBKDF2_SCHEME, str(_PBKDF2_ITERATIONS)]
+
+
+def hash_passwords(
+    passwords: Iterable[str],
+    workers: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> List[str]:
+    """Hash many passwords across a process pool, keeping input order.
+
+    ``progress`` is called with ``(done, total)`` as each hash finishes.
+    """
+    passwords = list(passwords)
+    total = len(passwords)
+    workers = min(workers or _int_setting("BOOKFLOW_HASH_WORKERS", os.cpu_count() or 1), total)
+
+    if workers <= 1 or total < _PARALLEL_MIN_BATCH:
+        hashes = []
+        for done, password in enumerate(passwords, 1):
+            hashes.append(hash_password(password))
+            if progress:
+                progress(done, total)
+        return hashes
+
+    hashes: List[str] = [""] * total
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(hash_password, password): index for index, password in enumerate(passwords)}
+        for done, future in enumerate(as_completed(futures), 1):
+            hashes[futures[future]] = future.result()
+            if progress:
+                progress(done, total)
+    return hashes
 
-    candidate_hash, _ = hash_password(password, salt)
-    return hmac.compare_digest(candidate_hash, password_hash)
+
+_DUMMY_PASSWORD_HASH: str | None = None
+
+
+def dummy_password_hash() -> str:
+    """Return a hash record that matches no real password.
+
+    Checking against it when a username is unknown makes failed logins take
+    as long as ones with a wrong password.
+    """
+    global _DUMMY_PASSWORD_HASH
+    if _DUMMY_PASSWORD_HASH is None:
+        _DUMMY_PASSWORD_HASH = hash_password(_encode_bytes(os.urandom(_SALT_BYTES)))
+    return _DUMMY_PASSWORD_HASH
 
 
 def ensure_password_fields(user: Dict[str, str]) -> bool:
     """Ensure the given user dict stores hashed credentials only.
 
-    If a legacy ``password`` field is present it will be converted to
-    ``password_hash`` + ``password_salt``. Returns True when a mutation occurs.
+    If a legacy ``password`` field is present it will be converted to a
+    ``password_hash`` record. Returns True when a mutation occurs.
     """
     mutated = False
 
-    if "password_hash" in user and "password_salt" in user:
+    if "password_hash" in user:
         if "password" in user:
             user.pop("password", None)
             mutated = True
@@ -66,9 +192,36 @@ def ensure_password_fields(user: Dict[str, str]) -> bool:
 
     plaintext = user.pop("password", None)
     if plaintext:
-        password_hash, password_salt = hash_password(plaintext)
-        user["password_hash"] = password_hash
-        user["password_salt"] = password_salt
+        user["password_hash"] = hash_password(plaintext)
+        user.pop("password_salt", None)
         mutated = True
 
     return mutated
+
+
+def ensure_password_fields_many(
+    users: Iterable[Dict[str, str]],
+    workers: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """Apply ``ensure_password_fields`` to many users, hashing in parallel.
+
+    Returns the number of users that were changed.
+    """
+    mutated = 0
+    pending = []
+    for user in users:
+        if "password_hash" in user:
+            if "password" in user:
+                user.pop("password", None)
+                mutated += 1
+            continue
+        plaintext = user.pop("password", None)
+        if plaintext:
+            pending.append((user, plaintext))
+
+    hashes = hash_passwords((plaintext for _, plaintext in pending), workers=workers, progress=progress)
+    for (user, _), password_hash in zip(pending, hashes):
+        user["password_hash"] = password_hash
+        user.pop("password_salt", None)
+    return mutated + len(pending)
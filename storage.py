@@ -0,0 +1,811 @@
+"""Storage backends used by BookFlow LMS to persist library data."""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable
+
+from records import json_default
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+UserRow = tuple[str, dict]
+BookRow = tuple[str, str, dict]
+
+FSYNC_POLICIES = ('always', 'batched', 'never')
+
+# Marks a backend that has not loaded or saved anything yet.
+_UNSEEN = object()
+
+
+class StorageConflict(RuntimeError):
+    """Raised when saving over data another process changed since it was read."""
+
+
+class FileLock:
+    """Advisory lock on ``path`` shared by every process using the same data.
+
+    Re-entrant within a process: nested ``with`` blocks on one thread take the
+    OS lock once, and other threads wait on an in-process lock first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd: int | None = None
+
+    def __enter__(self) -> FileLock:
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    _lock_fd(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+
+def _lock_fd(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            # LK_LOCK gives up after ten one-second retries; keep waiting.
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_fd(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _file_signature(path: str) -> tuple | None:
+    """An etag for ``path``: atomic saves replace the file, changing all three."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class FsyncPolicy:
+    """When writes are forced to disk, configured by ``BOOKFLOW_FSYNC``.
+
+    ``always`` fsyncs every write. ``batched`` fsyncs journal appends at most
+    once every ``interval`` seconds (``BOOKFLOW_FSYNC_INTERVAL``), so a power
+    cut can lose the last few seconds of appended changes; whole files
+    replaced by ``atomic_write_json`` are still fsynced every time, since an
+    unsynced rename can leave an empty file after a power cut. ``never``
+    leaves flushing to the operating system, which protects against crashed
+    processes but not against power loss.
+    """
+
+    def __init__(self, mode: str = 'always', interval: float = 1.0):
+        if mode not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {mode}")
+        self.mode = mode
+        self.interval = interval
+        self._last_sync = float('-inf')
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> FsyncPolicy:
+        mode = (os.getenv('BOOKFLOW_FSYNC') or 'always').strip().lower()
+        interval = os.getenv('BOOKFLOW_FSYNC_INTERVAL')
+        return cls(mode, float(interval) if interval else 1.0)
+
+    def due(self) -> bool:
+        """Return whether the write being made now should be fsynced."""
+        if self.mode != 'batched':
+            return self.mode == 'always'
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sync < self.interval:
+                return False
+            self._last_sync = now
+            return True
+
+
+def _fsync_directory(directory: str) -> None:
+    """Make a rename inside ``directory`` durable (not possible on Windows)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path: str, data, *, indent: int = 4, fsync: FsyncPolicy | None = None) -> None:
+    """Write ``data`` as JSON to ``path`` without ever leaving a partial file.
+
+    The document is written to a temporary file next to ``path``, fsynced
+    and renamed over ``path``; the directory is then fsynced so the rename
+    itself survives a power cut. Only the ``never`` policy skips the syncs.
+    """
+    policy = fsync or FsyncPolicy.from_env()
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, default=json_default)
+            f.flush()
+            # Batching would let an unsynced file replace the synced one.
+            synced = policy.mode != 'never'
+            if synced:
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    if synced:
+        _fsync_directory(directory)
+
+
+class StorageBackend:
+    """Base class for BookFlow storage backends.
+
+    ``load`` returns the full data graph (``users``, ``books``, ``transactions``
+    and ``reservations``) or ``None`` when nothing has been stored yet, and
+    ``save`` replaces it. Backends that can persist individual records set
+    ``supports_record_writes`` and implement ``write``. ``export_json`` and
+    ``import_json`` copy the data to and from the ``bookflow_data.json``
+    layout, whatever the backend, for backups and moving between backends.
+
+    Several processes may share the same data. ``locked`` holds a
+    cross-process lock for a read-modify-write cycle, ``changed`` reports
+    whether another process saved since this backend last loaded or saved,
+    and saving over such a change raises ``StorageConflict``.
+    """
+
+    supports_record_writes = False
+
+    def locked(self):
+        return contextlib.nullcontext()
+
+    def changed(self) -> bool:
+        return False
+
+    def load(self) -> dict | None:
+        raise NotImplementedError
+
+    def save(self, data: dict) -> None:
+        raise NotImplementedError
+
+    def write(
+        self,
+        *,
+        users: Iterable[UserRow] = (),
+        books: Iterable[BookRow] = (),
+        transactions: Iterable[dict] = (),
+        reservations: Iterable[dict] = (),
+        deleted_users: Iterable[tuple[str, str]] = (),
+        deleted_books: Iterable[tuple[str, str, str]] = (),
+    ) -> None:
+        """Persist only the given records.
+
+        ``users`` holds ``(role, user)`` pairs and ``books`` holds
+        ``(section, group, book)`` triples, where ``section`` is a key of the
+        ``books`` mapping and ``group`` the programme or collection name.
+        """
+        raise NotImplementedError
+
+    def import_json(self, path: str) -> None:
+        """Replace the stored data with a BookFlow JSON export."""
+        data = JsonStorage(path).load()
+        if data is None:
+            raise FileNotFoundError(path)
+        with self.locked():
+            # Loading first marks the current data as seen, so the restore
+            # deliberately overwrites it instead of raising StorageConflict.
+            self.load()
+            self.save(data)
+
+    def export_json(self, path: str) -> None:
+        """Write the stored data in the ``bookflow_data.json`` layout."""
+        with self.locked():
+            data = self.load() or {}
+        JsonStorage(path).save(data)
+
+
+class JsonStorage(StorageBackend):
+    """Keeps the whole library in a single JSON document.
+
+    Saves replace the document atomically, so a crash mid-save keeps the
+    previous copy intact.
+    """
+
+    def __init__(self, path: str, fsync: FsyncPolicy | None = None):
+        self.path = path
+        self.fsync = fsync or FsyncPolicy.from_env()
+        self._file_lock = FileLock(f"{path}.lock")
+        self._seen = _UNSEEN
+
+    def locked(self) -> FileLock:
+        return self._file_lock
+
+    def _signature(self):
+        return _file_signature(self.path)
+
+    def changed(self) -> bool:
+        return self._seen is not _UNSEEN and self._signature() != self._seen
+
+    def load(self) -> dict | None:
+        with self.locked():
+            self._seen = self._signature()
+            try:
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return None
+
+    def save(self, data: dict) -> None:
+        with self.locked():
+            if self.changed():
+                raise StorageConflict(f"{self.path} was changed by another process")
+            atomic_write_json(self.path, data, fsync=self.fsync)
+            self._seen = self._signature()
+
+
+class SqliteStorage(StorageBackend):
+    """Stores users, books, transactions and reservations as SQLite rows.
+
+    Each record is kept as a JSON blob next to the columns needed to address
+    it, so a borrow or return rewrites one or two rows instead of the whole
+    library. Books are keyed by section, group (programme or collection) and
+    id, because programmes share book ids. When the database is empty and
+    ``import_path`` points at an existing JSON export, that file is imported
+    on first load.
+    """
+
+    supports_record_writes = True
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            role TEXT NOT NULL,
+            id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (role, id)
+        );
+        CREATE TABLE IF NOT EXISTS books (
+            section TEXT NOT NULL,
+            grp TEXT NOT NULL,
+            id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (section, grp, id)
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER NOT NULL PRIMARY KEY,
+            user_id TEXT,
+            book_id TEXT,
+            status TEXT,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transactions_user ON transactions (user_id);
+        CREATE INDEX IF NOT EXISTS transactions_book ON transactions (book_id, status);
+        CREATE TABLE IF NOT EXISTS reservations (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            book_id TEXT,
+            status TEXT,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+    """
+
+    # SQLite does its own syncing; map the fsync policy onto it.
+    _SYNCHRONOUS = {'always': 'FULL', 'batched': 'NORMAL', 'never': 'OFF'}
+
+    def __init__(self, path: str, import_path: str | None = None, fsync: FsyncPolicy | None = None):
+        self.path = path
+        self.import_path = import_path
+        self.fsync = fsync or FsyncPolicy.from_env()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock") if path != ':memory:' else None
+        self._seen = _UNSEEN
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={self._SYNCHRONOUS[self.fsync.mode]}")
+        with self.locked():
+            self._set_aside_untyped_transactions()
+            self._conn.executescript(self._SCHEMA)
+            self._restore_untyped_transactions()
+
+    def _set_aside_untyped_transactions(self) -> None:
+        """Rename a ``transactions`` table made before ``id`` had a type."""
+        columns = {row[1]: row[2] for row in self._conn.execute("PRAGMA table_info(transactions)")}
+        if not columns or columns['id'].upper() == 'INTEGER':
+            return
+        with self._conn:
+            self._conn.execute("DROP INDEX IF EXISTS transactions_user")
+            self._conn.execute("DROP INDEX IF EXISTS transactions_book")
+            self._conn.execute("ALTER TABLE transactions RENAME TO transactions_untyped")
+
+    def _restore_untyped_transactions(self) -> None:
+        """Copy set-aside rows into the typed table; duplicate ids raise."""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_untyped'"
+        ).fetchone()
+        if not exists:
+            return
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO transactions (id, user_id, book_id, status, position, data) "
+                "SELECT id, user_id, book_id, status, position, data FROM transactions_untyped"
+            )
+            self._conn.execute("DROP TABLE transactions_untyped")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _get_meta(self, key: str):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, key: str, value) -> None:
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, default=json_default)),
+        )
+
+    def locked(self):
+        return self._file_lock or contextlib.nullcontext()
+
+    def _data_version(self) -> int:
+        # Changes whenever another connection commits; our own commits keep it.
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def changed(self) -> bool:
+        if self._seen is _UNSEEN:
+            return False
+        with self._lock:
+            return self._data_version() != self._seen
+
+    def _check_unchanged(self) -> None:
+        if self._seen is not _UNSEEN and self._data_version() != self._seen:
+            raise StorageConflict(f"{self.path} was changed by another process")
+
+    def load(self) -> dict | None:
+        with self.locked():
+            return self._load()
+
+    def _load(self) -> dict | None:
+        with self._lock:
+            self._seen = self._data_version()
+            layout = self._get_meta('layout')
+            schema_version = self._get_meta('schema_version')
+        if layout is None:
+            if self.import_path and os.path.exists(self.import_path):
+                data = JsonStorage(self.import_path).load()
+                if data is not None:
+                    self.save(data)
+                return data
+            return None
+
+        with self._lock:
+            users: dict[str, list[dict]] = {role: [] for role in layout.get('users', [])}
+            for role, data in self._conn.execute(
+                "SELECT role, data FROM users ORDER BY role, position"
+            ):
+                users.setdefault(role, []).append(json.loads(data))
+
+            books: dict = {}
+            for section, groups in layout.get('books', {}).items():
+                books[section] = {group: [] for group in groups} if groups is not None else []
+            for section, group, data in self._conn.execute(
+                "SELECT section, grp, data FROM books ORDER BY section, grp, position"
+            ):
+                container = books.setdefault(section, {} if group else [])
+                if isinstance(container, dict):
+                    container.setdefault(group, []).append(json.loads(data))
+                else:
+                    container.append(json.loads(data))
+
+            transactions = [
+                json.loads(data)
+                for (data,) in self._conn.execute("SELECT data FROM transactions ORDER BY position")
+            ]
+            reservations = [
+                json.loads(data)
+                for (data,) in self._conn.execute("SELECT data FROM reservations ORDER BY position")
+            ]
+
+        data = {
+            'users': users,
+            'books': books,
+            'transactions': transactions,
+            'reservations': reservations,
+        }
+        if schema_version is not None:
+            data['schema_version'] = schema_version
+        return data
+
+    def save(self, data: dict) -> None:
+        users = data.get('users', {})
+        books = data.get('books', {})
+        layout = {
+            'users': list(users.keys()),
+            'books': {
+                section: list(content.keys()) if isinstance(content, dict) else None
+                for section, content in books.items()
+            },
+        }
+
+        # Plain INSERTs: two records with the same key raise IntegrityError
+        # (and roll the save back) instead of one silently replacing the other.
+        with self.locked(), self._lock, self._conn:
+            self._check_unchanged()
+            for table in ('users', 'books', 'transactions', 'reservations'):
+                self._conn.execute(f"DELETE FROM {table}")
+            self._conn.executemany(
+                "INSERT INTO users (role, id, position, data) VALUES (?, ?, ?, ?)",
+                [
+                    (role, str(user.get('id')), position, json.dumps(user, default=json_default))
+                    for role, role_users in users.items()
+                    for position, user in enumerate(role_users)
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO books (section, grp, id, position, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (section, group, str(book.get('id')), position, json.dumps(book, default=json_default))
+                    for section, group, group_books in _iter_book_groups(books)
+                    for position, book in enumerate(group_books)
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO transactions (id, user_id, book_id, status, position, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    _record_row(record, position)
+                    for position, record in enumerate(data.get('transactions', []))
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO reservations (id, user_id, book_id, status, position, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    _record_row(record, position)
+                    for position, record in enumerate(data.get('reservations', []))
+                ],
+            )
+            self._set_meta('layout', layout)
+            if 'schema_version' in data:
+                self._set_meta('schema_version', data['schema_version'])
+
+    def write(
+        self,
+        *,
+        users: Iterable[UserRow] = (),
+        books: Iterable[BookRow] = (),
+        transactions: Iterable[dict] = (),
+        reservations: Iterable[dict] = (),
+        deleted_users: Iterable[tuple[str, str]] = (),
+        deleted_books: Iterable[tuple[str, str, str]] = (),
+    ) -> None:
+        with self.locked(), self._lock, self._conn:
+            self._check_unchanged()
+            for role, user in users:
+                self._conn.execute(
+                    "INSERT INTO users (role, id, position, data) VALUES (?, ?, "
+                    "(SELECT COALESCE(MAX(position), -1) + 1 FROM users WHERE role = ?), ?) "
+                    "ON CONFLICT(role, id) DO UPDATE SET data = excluded.data",
+                    (role, str(user.get('id')), role, json.dumps(user, default=json_default)),
+                )
+            for role, user_id in deleted_users:
+                self._conn.execute("DELETE FROM users WHERE role = ? AND id = ?", (role, str(user_id)))
+            for section, group, book in books:
+                self._conn.execute(
+                    "INSERT INTO books (section, grp, id, position, data) VALUES (?, ?, ?, "
+                    "(SELECT COALESCE(MAX(position), -1) + 1 FROM books WHERE section = ? AND grp = ?), ?) "
+                    "ON CONFLICT(section, grp, id) DO UPDATE SET data = excluded.data",
+                    (section, group, str(book.get('id')), section, group, json.dumps(book, default=json_default)),
+                )
+            for section, group, book_id in deleted_books:
+                self._conn.execute(
+                    "DELETE FROM books WHERE section = ? AND grp = ? AND id = ?",
+                    (section, group, str(book_id)),
+                )
+            for table, records in (('transactions', transactions), ('reservations', reservations)):
+                for record in records:
+                    self._conn.execute(
+                        f"INSERT INTO {table} (id, user_id, book_id, status, position, data) VALUES (?, ?, ?, ?, "
+                        f"(SELECT COALESCE(MAX(position), -1) + 1 FROM {table}), ?) "
+                        "ON CONFLICT(id) DO UPDATE SET user_id = excluded.user_id, "
+                        "book_id = excluded.book_id, status = excluded.status, data = excluded.data",
+                        (
+                            record.get('id'),
+                            record.get('user_id'),
+                            record.get('book_id'),
+                            record.get('status'),
+                            json.dumps(record, default=json_default),
+                        ),
+                    )
+
+
+class JournalStorage(JsonStorage):
+    """JSON snapshot plus an append-only journal of record mutations.
+
+    Every ``write`` appends one JSON line per touched record to
+    ``journal_path`` so its cost depends on the size of the change, not the
+    catalogue. ``load`` replays the journal on top of the snapshot, and once
+    the journal grows past ``max_journal_bytes`` it is folded into a fresh
+    snapshot by ``compact``.
+    """
+
+    supports_record_writes = True
+
+    def __init__(
+        self,
+        path: str,
+        journal_path: str | None = None,
+        max_journal_bytes: int = 1_048_576,
+        fsync: FsyncPolicy | None = None,
+    ):
+        super().__init__(path, fsync=fsync)
+        self.journal_path = journal_path or f"{os.path.splitext(path)[0]}.journal"
+        self.max_journal_bytes = max_journal_bytes
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        return _file_signature(self.path), _file_signature(self.journal_path)
+
+    def load(self) -> dict | None:
+        with self.locked(), self._lock:
+            return self._load_unlocked()
+
+    def _load_unlocked(self) -> dict | None:
+        data = super().load()
+        if data is None:
+            return None
+        try:
+            with open(self.journal_path, 'r') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return data
+        # Every complete entry ends in a newline. Text after the last one is
+        # an append that never finished and is not replayed.
+        lines = text.split('\n')[:-1]
+        entries = []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("Skipping unreadable line %d of %s", number, self.journal_path)
+        _replay_journal(data, entries)
+        return data
+
+    def _trim_torn_tail(self) -> None:
+        """Cut a partial last entry so the next append starts on its own line."""
+        try:
+            f = open(self.journal_path, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b'\n':
+                return
+            # Scan back in blocks for the newline ending the last whole entry.
+            position = end
+            while position > 0:
+                start = max(position - 65536, 0)
+                f.seek(start)
+                index = f.read(position - start).rfind(b'\n')
+                if index != -1:
+                    f.truncate(start + index + 1)
+                    return
+                position = start
+            f.truncate(0)
+
+    def save(self, data: dict) -> None:
+        with self.locked(), self._lock:
+            self._save_unlocked(data)
+
+    def _save_unlocked(self, data: dict) -> None:
+        super().save(data)
+        # Entries are idempotent upserts/deletes, so a crash between the
+        # snapshot write and this truncation only replays them again.
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+        self._seen = self._signature()
+
+    def write(
+        self,
+        *,
+        users: Iterable[UserRow] = (),
+        books: Iterable[BookRow] = (),
+        transactions: Iterable[dict] = (),
+        reservations: Iterable[dict] = (),
+        deleted_users: Iterable[tuple[str, str]] = (),
+        deleted_books: Iterable[tuple[str, str, str]] = (),
+    ) -> None:
+        entries = (
+            [{'op': 'put_user', 'role': role, 'record': user} for role, user in users]
+            + [{'op': 'delete_user', 'role': role, 'id': user_id} for role, user_id in deleted_users]
+            + [
+                {'op': 'put_book', 'section': section, 'group': group, 'record': book}
+                for section, group, book in books
+            ]
+            + [
+                {'op': 'delete_book', 'section': section, 'group': group, 'id': book_id}
+                for section, group, book_id in deleted_books
+            ]
+            + [{'op': 'put_transaction', 'record': record} for record in transactions]
+            + [{'op': 'put_reservation', 'record': record} for record in reservations]
+        )
+        if not entries:
+            return
+
+        with self.locked(), self._lock:
+            if self.changed():
+                raise StorageConflict(f"{self.path} was changed by another process")
+            self._trim_torn_tail()
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(json.dumps(entry, default=json_default) + '\n' for entry in entries))
+                f.flush()
+                # Under 'batched' the next synced append also covers these lines.
+                if self.fsync.due():
+                    os.fsync(f.fileno())
+            self._seen = self._signature()
+            if os.path.getsize(self.journal_path) > self.max_journal_bytes:
+                self._compact_unlocked()
+
+    def compact(self) -> None:
+        """Fold the journal into a fresh snapshot."""
+        with self.locked(), self._lock:
+            self._compact_unlocked()
+
+    def _compact_unlocked(self) -> None:
+        data = self._load_unlocked()
+        if data is not None:
+            self._save_unlocked(data)
+
+
+def _replay_journal(data: dict, entries: list[dict]) -> None:
+    users = data.setdefault('users', {})
+    books = data.setdefault('books', {})
+    positions: dict[tuple, dict] = {}
+
+    def upsert(records: list, key: tuple, record: dict) -> None:
+        lookup = positions.get(key)
+        if lookup is None:
+            lookup = positions[key] = {item.get('id'): idx for idx, item in enumerate(records)}
+        idx = lookup.get(record.get('id'))
+        if idx is None:
+            lookup[record.get('id')] = len(records)
+            records.append(record)
+        else:
+            records[idx] = record
+
+    def remove(records: list, key: tuple, record_id) -> None:
+        records[:] = [item for item in records if item.get('id') != record_id]
+        positions.pop(key, None)
+
+    def book_group(section: str, group: str) -> list:
+        content = books.get(section)
+        if content is None:
+            content = books[section] = {} if group else []
+        return content.setdefault(group, []) if isinstance(content, dict) else content
+
+    for entry in entries:
+        op = entry.get('op')
+        if op == 'put_user':
+            role = entry['role']
+            upsert(users.setdefault(role, []), ('users', role), entry['record'])
+        elif op == 'delete_user':
+            role = entry['role']
+            remove(users.setdefault(role, []), ('users', role), entry['id'])
+        elif op == 'put_book':
+            key = ('books', entry['section'], entry['group'])
+            upsert(book_group(entry['section'], entry['group']), key, entry['record'])
+        elif op == 'delete_book':
+            key = ('books', entry['section'], entry['group'])
+            remove(book_group(entry['section'], entry['group']), key, entry['id'])
+        elif op == 'put_transaction':
+            upsert(data.setdefault('transactions', []), ('transactions',), entry['record'])
+        elif op == 'put_reservation':
+            upsert(data.setdefault('reservations', []), ('reservations',), entry['record'])
+
+
+def _iter_book_groups(books: dict):
+    for section, content in books.items():
+        if isinstance(content, dict):
+            for group, group_books in content.items():
+                yield section, group, group_books
+        else:
+            yield section, '', content
+
+
+def _record_row(record: dict, position: int) -> tuple:
+    return (
+        record.get('id'),
+        record.get('user_id'),
+        record.get('book_id'),
+        record.get('status'),
+        position,
+        json.dumps(record, default=json_default),
+    )
+
+
+def create_storage(data_file: str) -> StorageBackend:
+    """Pick the storage backend configured through ``BOOKFLOW_STORAGE``.
+
+    ``json`` (the default) keeps using ``data_file`` directly. ``journal``
+    keeps ``data_file`` as a snapshot and appends mutations to
+    ``BOOKFLOW_JOURNAL_PATH`` (``<data_file>.journal`` by default), compacting
+    once it exceeds ``BOOKFLOW_JOURNAL_MAX_BYTES``. ``sqlite`` stores records
+    in ``BOOKFLOW_SQLITE_PATH`` (``<data_file>.db`` by default) and imports
+    ``data_file`` the first time the database is opened.
+    """
+    backend = (os.getenv('BOOKFLOW_STORAGE') or 'json').strip().lower()
+    if backend == 'json':
+        return JsonStorage(data_file)
+    if backend == 'journal':
+        max_bytes = os.getenv('BOOKFLOW_JOURNAL_MAX_BYTES')
+        return JournalStorage(
+            data_file,
+            journal_path=os.getenv('BOOKFLOW_JOURNAL_PATH'),
+            max_journal_bytes=int(max_bytes) if max_bytes else 1_048_576,
+        )
+    if backend == 'sqlite':
+        db_path = os.getenv('BOOKFLOW_SQLITE_PATH') or f"{os.path.splitext(data_file)[0]}.db"
+        return SqliteStorage(db_path, import_path=data_file)
+    raise ValueError(f"Unknown storage backend: {backend}")
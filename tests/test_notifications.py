@@ -0,0 +1,248 @@
+"""Outbox delivery against a local SMTP stand-in server."""
+
+import json
+import socketserver
+import threading
+import time
+from email.message import EmailMessage
+
+import pytest
+
+from notifications import EmailOutbox, PooledSmtpTransport, SmtpSettings
+from storage import FsyncPolicy
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: refuses or fails recipients on request."""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        server = self.server
+        recipients: list[str] = []
+        self.reply("220 stand-in ready")
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply("250 stand-in")
+            elif verb in ('MAIL', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'RSET':
+                recipients.clear()
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip(' <>')
+                if address in server.refused:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for data in self.rfile:
+                    if data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data.decode())
+                with server.lock:
+                    for address in recipients:
+                        server.attempts.setdefault(address, []).append(time.monotonic())
+                    failing = [address for address in recipients if server.failures.get(address, 0) > 0]
+                    for address in failing:
+                        server.failures[address] -= 1
+                    if not failing:
+                        server.messages.append(''.join(lines))
+                recipients.clear()
+                self.reply("451 Try again later" if failing else "250 Queued")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Not implemented")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+        self.lock = threading.Lock()
+        self.messages: list[str] = []
+        self.attempts: dict[str, list[float]] = {}
+        # Addresses rejected at RCPT, and how many more DATA commands to fail.
+        self.refused: set[str] = set()
+        self.failures: dict[str, int] = {}
+
+
+@pytest.fixture
+def smtp_server():
+    server = SmtpStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox_path(tmp_path):
+    return str(tmp_path / 'outbox.json')
+
+
+@pytest.fixture
+def make_outbox(smtp_server, outbox_path):
+    outboxes = []
+
+    def make(**options):
+        settings = SmtpSettings(
+            '127.0.0.1', smtp_server.server_address[1], None, None, 'library@example.com',
+            security='none', timeout=5,
+        )
+        options.setdefault('base_delay', 0.05)
+        outbox = EmailOutbox(
+            outbox_path,
+            transport=PooledSmtpTransport(settings),
+            sender=settings.sender,
+            fsync=FsyncPolicy('never'),
+            poll_interval=0.05,
+            **options,
+        )
+        outboxes.append(outbox)
+        return outbox
+
+    yield make
+    for outbox in outboxes:
+        outbox.stop()
+
+
+def message(to: str, subject: str = 'Reservation confirmed') -> EmailMessage:
+    email = EmailMessage()
+    email['From'] = 'library@example.com'
+    email['To'] = to
+    email['Subject'] = subject
+    email.set_content('Hello from BookFlow')
+    return email
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.02)
+    raise AssertionError('timed out waiting for the outbox')
+
+
+def finished(outbox, message_id):
+    entry = outbox.status(message_id)
+    return entry if entry['status'] in ('sent', 'failed') else None
+
+
+def test_enqueued_message_is_delivered(make_outbox, smtp_server):
+    outbox = make_outbox()
+    entry = outbox.enqueue(message('reader@example.com', 'Hold ready'), kind='hold', reference='RSV1')
+
+    result = wait_for(lambda: finished(outbox, entry['id']))
+
+    assert result['status'] == 'sent'
+    assert result['attempts'] == 1
+    assert result['last_error'] is None
+    assert len(smtp_server.messages) == 1
+    assert 'Subject: Hold ready' in smtp_server.messages[0]
+    assert outbox.pending_count() == 0
+
+
+def test_transient_failure_is_retried_after_backoff(make_outbox, smtp_server):
+    smtp_server.failures['flaky@example.com'] = 2
+    outbox = make_outbox(base_delay=0.2)
+    entry = outbox.enqueue(message('flaky@example.com'))
+
+    result = wait_for(lambda: finished(outbox, entry['id']))
+
+    assert result['status'] == 'sent'
+    assert result['attempts'] == 3
+    first, second, third = smtp_server.attempts['flaky@example.com']
+    # base_delay * 2 ** (attempts - 1) with at most 20% jitter either way.
+    assert second - first >= 0.2 * 0.8 - 0.02
+    assert third - second >= 0.4 * 0.8 - 0.02
+
+
+def test_gives_up_after_max_attempts(make_outbox, smtp_server):
+    smtp_server.failures['down@example.com'] = 10
+    outbox = make_outbox(max_attempts=2, base_delay=0.01)
+    entry = outbox.enqueue(message('down@example.com'))
+
+    result = wait_for(lambda: finished(outbox, entry['id']))
+
+    assert result['status'] == 'failed'
+    assert result['attempts'] == 2
+    assert 'Try again later' in result['last_error']
+    assert smtp_server.messages == []
+
+
+def test_permanent_error_fails_without_retrying(make_outbox, smtp_server):
+    smtp_server.refused.add('nobody@example.com')
+    outbox = make_outbox()
+    entry = outbox.enqueue(message('nobody@example.com'))
+
+    result = wait_for(lambda: finished(outbox, entry['id']))
+
+    assert result['status'] == 'failed'
+    assert result['attempts'] == 1
+    assert 'nobody@example.com' in result['last_error']
+    assert smtp_server.messages == []
+
+
+def test_restart_resends_interrupted_deliveries(make_outbox, smtp_server, outbox_path):
+    now = time.time()
+
+    def stored(message_id, to, **fields):
+        email = message(to, message_id)
+        entry = {
+            'id': message_id, 'kind': 'email', 'reference': None, 'to': to, 'subject': message_id,
+            'raw': email.as_string(), 'status': 'sending', 'attempts': 1, 'created_at': now,
+            'next_attempt_at': now, 'last_error': None,
+        }
+        entry.update(fields)
+        return entry
+
+    with open(outbox_path, 'w', encoding='utf-8') as fh:
+        json.dump([
+            # The process delivering this one died; its claim has run out.
+            stored('MSG-DEAD', 'a@example.com', claimed_by='gone', claimed_until=now - 1),
+            # Written before claims were recorded.
+            stored('MSG-OLD', 'b@example.com'),
+            # Still being delivered by another live process.
+            stored('MSG-BUSY', 'c@example.com', claimed_by='busy', claimed_until=now + 600),
+        ], fh)
+
+    outbox = make_outbox()
+    assert outbox.pending_count() == 3
+    outbox.start()
+
+    wait_for(lambda: outbox.pending_count() == 1)
+
+    assert outbox.status('MSG-DEAD')['status'] == 'sent'
+    assert outbox.status('MSG-OLD')['status'] == 'sent'
+    assert outbox.status('MSG-DEAD')['attempts'] == 2
+    busy = outbox.status('MSG-BUSY')
+    assert busy['status'] == 'sending' and busy['claimed_by'] == 'busy'
+    assert len(smtp_server.messages) == 2
+
+
+def test_outboxes_sharing_a_file_keep_each_others_mail(make_outbox, smtp_server):
+    first, second = make_outbox(), make_outbox()
+    ids = [
+        outbox.enqueue(message(f'reader{n}@example.com'))['id']
+        for n, outbox in enumerate([first, second, first, second])
+    ]
+
+    for message_id in ids:
+        wait_for(lambda: finished(first, message_id))
+
+    assert all(first.status(message_id)['status'] == 'sent' for message_id in ids)
+    assert len(smtp_server.messages) == 4